@@ -0,0 +1,315 @@
+"""Benchmarks for Text Manager Pro's core functions.
+
+Runs outside text-generation-webui: modules.chat, modules.shared and the
+tokenizer are replaced by deterministic fakes (gradio too, if it is not
+installed), and every run works on seeded synthetic corpora in a throwaway
+directory. Results are printed as JSON so runs from different commits can
+be compared directly.
+
+    python benchmark.py                          # 1KB, 1MB and 16MB corpora
+    python benchmark.py --full -o bench.json     # 1KB up to 1GB
+    python benchmark.py --sizes 64KB --only search,process
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import zlib
+import re
+import atexit
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import importlib.util
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = "1KB,1MB,16MB"
+FULL_SIZES = "1KB,32KB,1MB,32MB,1GB"
+UNITS = {"B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+TOKEN_RE = re.compile(r"\w+|[^\w\s]|\s+")
+RARE_WORD = "zyzzyva"
+
+def fake_encode(prompt, add_special_tokens=True, add_bos_token=True, truncation_length=None):
+    """Deterministic stand-in tokenizer: one token per word, punctuation mark or whitespace run."""
+    ids = [zlib.crc32(token.encode("utf-8")) % 32000 for token in TOKEN_RE.findall(prompt)]
+    if add_special_tokens and add_bos_token:
+        ids.insert(0, 1)
+    return [ids]
+
+def fake_decode(ids, skip_special_tokens=True):
+    """Inverse of nothing in particular; only needs to return text."""
+    return " ".join(f"t{i}" for i in ids)
+
+def fake_generate_reply(question, state, stopping_strings=None, is_chat=False, **kwargs):
+    """Stream a fixed reply the way generate_reply does."""
+    reply = ""
+    for word in ("Benchmark", " reply", " text."):
+        reply += word
+        yield reply
+
+class GradioStub(types.ModuleType):
+    """Enough of gradio for script.py to import; components are inert."""
+
+    class Component:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: GradioStub.Component()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def __getattr__(self, name):
+        if name == "update":
+            return lambda **kwargs: kwargs
+        return GradioStub.Component
+
+def install_stubs():
+    """Register the fake webui modules, and gradio if it is missing."""
+    modules = types.ModuleType("modules")
+    chat = types.ModuleType("modules.chat")
+    shared = types.ModuleType("modules.shared")
+    shared.settings = {"truncation_length": 2048, "max_new_tokens": 512}
+    text_generation = types.ModuleType("modules.text_generation")
+    text_generation.encode = fake_encode
+    text_generation.decode = fake_decode
+    text_generation.generate_reply = fake_generate_reply
+    modules.chat, modules.shared, modules.text_generation = chat, shared, text_generation
+    sys.modules.update({
+        "modules": modules,
+        "modules.chat": chat,
+        "modules.shared": shared,
+        "modules.text_generation": text_generation
+    })
+    try:
+        import gradio  # noqa: F401
+    except ImportError:
+        sys.modules["gradio"] = GradioStub("gradio")
+
+def parse_size(text):
+    """Parse sizes such as 1KB, 16MB or 1GB."""
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?B)\s*", text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"bad size: {text}")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+def make_corpus(size, seed):
+    """Seeded prose-like text of about size bytes, with a rare word sprinkled in."""
+    rng = random.Random(seed)
+    vocabulary = ["the", "of", "and", "to", "in", "is", "that", "for", "it", "as"] + [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+        for _ in range(5000)
+    ]
+    weights = [50] * 10 + [1] * 5000
+    pieces, total = [], 0
+    while total < size:
+        words = rng.choices(vocabulary, weights, k=4096)
+        if rng.random() < 0.05:
+            words[rng.randrange(len(words))] = RARE_WORD
+        lines = []
+        for start in range(0, len(words), 12):
+            line = " ".join(words[start:start + rng.randint(4, 12)]) + "."
+            if rng.random() < 0.02:
+                line += " https://example.com/" + words[start]
+            lines.append(line)
+            if rng.random() < 0.1:
+                lines.append("")
+        block = "\n".join(lines) + "\n"
+        pieces.append(block)
+        total += len(block)
+    return "".join(pieces)[:size]
+
+def mutate(content, seed, fraction=0.01):
+    """Change about fraction of the lines, as an editing session would."""
+    rng = random.Random(seed + 1)
+    lines = content.split("\n")
+    for _ in range(max(1, int(len(lines) * fraction))):
+        i = rng.randrange(len(lines))
+        choice = rng.random()
+        if choice < 0.4:
+            lines[i] = lines[i].upper()
+        elif choice < 0.7:
+            lines.insert(i, "inserted line for the benchmark.")
+        else:
+            del lines[i]
+    return "\n".join(lines)
+
+def load_extension(workdir):
+    """Import a private copy of script.py whose files live in workdir."""
+    shutil.copy(os.path.join(HERE, "script.py"), workdir)
+    name = f"text_manager_bench_{abs(hash(workdir))}"
+    spec = importlib.util.spec_from_file_location(name, os.path.join(workdir, "script.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def prepare_workdir(root, corpus=None):
+    """A fresh extension directory, optionally holding the corpus as files/corpus.txt."""
+    workdir = tempfile.mkdtemp(dir=root)
+    if corpus is not None:
+        os.makedirs(os.path.join(workdir, "files"))
+        with open(os.path.join(workdir, "files", "corpus.txt"), "w", encoding="utf-8") as f:
+            f.write(corpus)
+    return workdir
+
+def measure(fn, repeat, time_limit, before=None):
+    """Run fn up to repeat times, stopping early once time_limit seconds have been spent."""
+    runs = []
+    spent = 0.0
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        runs.append(elapsed)
+        spent += elapsed
+        if spent >= time_limit:
+            break
+    return runs
+
+def summarize(name, size, size_bytes, runs):
+    """One result record."""
+    best = min(runs)
+    return {
+        "name": name,
+        "size": size,
+        "bytes": size_bytes,
+        "runs": [round(run, 6) for run in runs],
+        "min": round(best, 6),
+        "median": round(statistics.median(runs), 6),
+        "mean": round(statistics.fmean(runs), 6),
+        "mb_per_s": round(size_bytes / best / (1 << 20), 3) if best > 0 else None
+    }
+
+def git_commit():
+    """The commit being benchmarked, if this is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_size(label, size, args, root):
+    """All benchmarks for one corpus size."""
+    results = []
+    corpus = make_corpus(size, args.seed)
+    edited = mutate(corpus, args.seed)
+    size_bytes = len(corpus.encode("utf-8"))
+    selected = lambda group: not args.only or group in args.only
+
+    def add(group, name, fn, before=None):
+        if not selected(group):
+            return
+        runs = measure(fn, args.repeat, args.time_limit, before)
+        results.append(summarize(name, label, size_bytes, runs))
+        print(f"  {name:<40} {results[-1]['min'] * 1000:10.2f} ms", file=sys.stderr)
+
+    if selected("setup"):
+        base = prepare_workdir(root, corpus)
+
+        def fresh_setup():
+            workdir = prepare_workdir(root)
+            shutil.copytree(os.path.join(base, "files"), os.path.join(workdir, "files"))
+            module = load_extension(workdir)
+            started = time.perf_counter()
+            module.setup()
+            return time.perf_counter() - started
+
+        runs = []
+        for _ in range(args.repeat):
+            runs.append(fresh_setup())
+            if sum(runs) >= args.time_limit:
+                break
+        results.append(summarize("setup", label, size_bytes, runs))
+        print(f"  {'setup':<40} {results[-1]['min'] * 1000:10.2f} ms", file=sys.stderr)
+
+    workdir = prepare_workdir(root, corpus)
+    m = load_extension(workdir)
+    m.setup()
+
+    add("search", "search_text[common]", lambda: m.search_text(corpus, "the", False))
+    add("search", "search_text[rare]", lambda: m.search_text(corpus, RARE_WORD, True))
+    add("search", "search_text[whole word]", lambda: m.search_text(corpus, "the", False, "Whole word"))
+    add("search", "search_text[regex]", lambda: m.search_text(corpus, r"https?://\S+", False, "Regex"))
+
+    for operation in m.OPERATIONS:
+        add("process", f"process_text[{operation}]",
+            lambda operation=operation: m.process_text(corpus, operation),
+            before=m.token_cache.clear)
+
+    add("diff", "get_diff", lambda: m.get_diff(corpus, edited))
+    add("dedup", "find_near_duplicates[paragraphs]",
+        lambda: list(m.find_near_duplicates("corpus.txt", "Paragraphs")),
+        before=m.minhash_state["files"].clear)
+
+    corpus_path = os.path.join(workdir, "files", "corpus.txt")
+
+    def reset_corpus():
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            f.write(corpus)
+        m.load_file_content(corpus_path)
+
+    add("save", "save_text[backup]", lambda: m.save_text(edited, "corpus.txt", create_backup=True),
+        before=reset_corpus)
+
+    for export_format in m.EXPORT_FORMATS:
+        add("export", f"export_text[{export_format}]",
+            lambda export_format=export_format: m.export_text(corpus, export_format, "corpus.txt"))
+    for compression in list(m.EXPORT_COMPRESSIONS)[1:]:
+        add("export", f"export_text[Text (.txt), {compression}]",
+            lambda compression=compression: m.export_text(corpus, "Text (.txt)", "corpus.txt", compression))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Text Manager Pro's core functions.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated corpus sizes (default {DEFAULT_SIZES})")
+    parser.add_argument("--full", action="store_true", help=f"use the full size ladder {FULL_SIZES}")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (default 5)")
+    parser.add_argument("--time-limit", type=float, default=10.0, help="stop repeating a benchmark after this many seconds")
+    parser.add_argument("--only", help="comma-separated groups: setup, search, process, diff, dedup, save, export")
+    parser.add_argument("--seed", type=int, default=1234, help="corpus seed (default 1234)")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    args.only = set(args.only.split(",")) if args.only else None
+    labels = [size.strip().upper() for size in (FULL_SIZES if args.full else args.sizes).split(",")]
+
+    install_stubs()
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.now().isoformat(),
+            "seed": args.seed,
+            "repeat": args.repeat
+        },
+        "results": []
+    }
+    root = tempfile.mkdtemp(prefix="text_manager_bench_")
+    # Registered before any extension copy is loaded, so it runs after their own exit handlers
+    atexit.register(shutil.rmtree, root, ignore_errors=True)
+    for label in labels:
+        print(f"{label}:", file=sys.stderr)
+        report["results"].extend(run_size(label, parse_size(label), args, root))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
 import os
+import sys
 import json
 import gradio as gr
 from datetime import datetime
-import difflib
 from pathlib import Path
 import re
+import math
+import time
+import atexit
+import hashlib
+import zlib
+import random
+import mmap
+import threading
+import fnmatch
+import heapq
+import tempfile
+import gzip
+import bz2
+import lzma
+import zipfile
+import tarfile
+import sqlite3
+import inspect
+import multiprocessing
+from functools import partial, wraps
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import deque, OrderedDict
+from itertools import islice
+from bisect import bisect_left
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from modules import chat, shared
-from modules.text_generation import encode
+from modules.text_generation import encode, decode, generate_reply
 
 params = {
     "display_name": "Text Manager Pro",
@@ -14,7 +43,58 @@ params = {
     "auto_refresh": False,
     "refresh_interval": 2,
     "default_files": ["info.txt", "notes.txt", "prompts.txt"],
-    "max_history": 10,
+    "max_history": 200,
+    "history_keyframe_interval": 20,
+    "backup_chunk_min": 2048,
+    "backup_chunk_max": 65536,
+    "large_file_threshold": 20 * 1024 * 1024,
+    "window_lines": 1000,
+    "token_cache_size": 4096,
+    "token_chunk_chars": 2000,
+    "batch_workers": None,
+    "sort_memory_budget": 64 * 1024 * 1024,
+    "sort_merge_fan_in": 64,
+    "sort_key_field": 0,
+    "sort_field_separator": None,
+    "sort_tmp_dir": None,
+    "sync_interval": 1.5,
+    "auto_save": True,
+    "autosave_interval": 3,
+    "autosave_max_delay": 30,
+    "bookmark_compact_after": 500,
+    "bookmark_search_radius": 200,
+    "retention_enabled": True,
+    "retention_interval": 3600,
+    "retention_dry_run": False,
+    "retention_keep_last": 20,
+    "retention_hourly": 24,
+    "retention_daily": 14,
+    "retention_weekly": 8,
+    "retention_max_bytes": 1024 * 1024 * 1024,
+    "trash_max_age_days": 30,
+    "trash_max_bytes": 512 * 1024 * 1024,
+    "storage_backend": "files",
+    "database": "workspace.db",
+    "chunk_max_tokens": 1024,
+    "chunk_overlap": 64,
+    "template_files": ["prompts.txt"],
+    "generation_buffer": 64 * 1024,
+    "stream_ui_interval": 0.25,
+    "template_token_budget": None,
+    "diff_max_cost": 2000,
+    "diff_timeout": 2.0,
+    "diff_context": 3,
+    "diff_max_hunks_displayed": 200,
+    "index_persist_interval": 30,
+    "max_search_results": 50,
+    "dedup_shingle_size": 5,
+    "dedup_num_perm": 128,
+    "dedup_bands": 32,
+    "dedup_threshold": 0.8,
+    "dedup_min_words": 8,
+    "dedup_max_clusters": 50,
+    "search_max_hits": 200,
+    "search_pattern_cache_size": 128,
     "enable_syntax_highlight": True,
     "theme": "dark"
 }
@@ -22,167 +102,2701 @@ params = {
 # Global variables
 displayed_text = ""
 extension_dir = ""
-text_history = []
-current_file = None
+text_history = {}
 file_contents = {}
 bookmarks = {}
 last_modified = {}
 
+# Workspace search index: term -> {filename: [line numbers]}
+search_index = {}
+indexed_files = {}
+index_state = {"dirty": False, "last_persist": 0.0, "ready": threading.Event()}
+index_state["ready"].set()
+WORD_RE = re.compile(r"\w+")
+
+# In-file search: compiled patterns (LRU) keyed by term, mode, case and str/bytes
+SEARCH_MODES = ["Literal", "Regex", "Whole word"]
+search_patterns = OrderedDict()
+search_patterns_lock = threading.Lock()
+
+# Files opened in large-file mode: filename -> line index and current window
+large_files = {}
+LINE_INDEX_BLOCK = 1 << 20
+
+OPERATIONS = [
+    "Trim Whitespace",
+    "Count Tokens",
+    "Count Words",
+    "Convert to Uppercase",
+    "Convert to Lowercase",
+    "Remove Empty Lines",
+    "Sort Lines",
+    "Sort Lines (Unique)",
+    "Sort Lines (Numeric)",
+    "Reverse Lines",
+    "Extract URLs",
+    "Format as Markdown List",
+    "Chunk by Tokens"
+]
+
+# Operations that need the loaded model and so cannot run in worker processes
+MODEL_OPERATIONS = {"Count Tokens", "Chunk by Tokens"}
+
+# Near-duplicate detection: MinHash signatures per file, keyed by mtime and size
+DEDUP_UNITS = ["Files", "Paragraphs"]
+MINHASH_SEED = 1
+MINHASH_BLOCK = 4096
+minhash_state = {"lock": threading.Lock(), "files": {}, "settings": None, "coefficients": {}}
+
+# Token counts: chunk hash -> count (LRU), filename -> (mtime, count)
+token_cache = OrderedDict()
+token_lock = threading.Lock()
+file_token_counts = {}
+token_count_state = {"lock": threading.Lock(), "executor": None, "pending": set()}
+
+# Write-behind auto-save: filename -> pending content and edit times
+autosave_queue = {}
+autosave_state = {"lock": threading.Lock(), "wake": threading.Event(), "thread": None}
+
+# Reader/writer locks per file path, plus guards for shared indexes
+file_locks = {}
+file_locks_guard = threading.Lock()
+index_lock = threading.RLock()
+bookmarks_lock = threading.RLock()
+bookmark_journal = {"entries": 0, "loaded": False}
+
+# Retention: backup store lock, incremental manifest cache and the background pruning thread
+backup_store_lock = threading.Lock()
+retention_state = {"thread": None, "stop": threading.Event(), "run_lock": threading.Lock(),
+                   "manifests": {}, "chunk_sizes": {}, "last_report": None}
+
+# SQLite store: one connection per thread, plus the depth of its open transaction
+db_state = {"local": threading.local()}
+
+# Directory listing cache and background watcher state
+file_list_cache = {"entries": None, "dir_mtime": None, "lines": {}}
+
+# Time spent in each phase of setup(), building the UI and building the search index
+startup_report = {"phases": {}, "total": None, "ui": None, "search_index": None}
+watcher_state = {"thread": None, "stop": threading.Event(), "seq": 0, "events": deque(maxlen=1000)}
+
+# Latency histograms: log-spaced buckets from 10µs, four per doubling, so memory stays fixed
+HISTOGRAM_BASE = 1e-5
+HISTOGRAM_STEPS = 4
+HISTOGRAM_BUCKETS = 100
+handler_stats = {}
+stats_lock = threading.Lock()
+
+def payload_size(value):
+    """Approximate size of handler arguments or results: characters of text, recursively.
+
+    Session state stays on the server, so it counts as nothing."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    if isinstance(value, dict):
+        if "editor_text" in value:
+            return 0
+        return sum(payload_size(item) for item in value.values())
+    return 0
+
+def record_call(name, elapsed, size_in, size_out, failed=False):
+    """Add one call to a handler's counters and latency histogram."""
+    bucket = 0
+    if elapsed > HISTOGRAM_BASE:
+        bucket = min(HISTOGRAM_BUCKETS - 1, math.ceil(HISTOGRAM_STEPS * math.log2(elapsed / HISTOGRAM_BASE)))
+    with stats_lock:
+        stats = handler_stats.get(name)
+        if stats is None:
+            stats = handler_stats[name] = {
+                "calls": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0,
+                "total": 0.0, "max": 0.0, "buckets": [0] * HISTOGRAM_BUCKETS
+            }
+        stats["calls"] += 1
+        stats["errors"] += failed
+        stats["bytes_in"] += size_in
+        stats["bytes_out"] += size_out
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["buckets"][bucket] += 1
+
+def percentile(stats, fraction):
+    """Upper bound of the histogram bucket holding the given fraction of calls."""
+    target = fraction * stats["calls"]
+    seen = 0
+    for bucket, count in enumerate(stats["buckets"]):
+        seen += count
+        if count and seen >= target:
+            return min(HISTOGRAM_BASE * 2 ** (bucket / HISTOGRAM_STEPS), stats["max"])
+    return stats["max"]
+
+def instrumented(fn, name=None):
+    """Wrap a function or generator to record its call count, payload sizes and latency."""
+    name = name or fn.__name__
+    if inspect.isgeneratorfunction(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result, failed = None, True
+            try:
+                for result in fn(*args, **kwargs):
+                    yield result
+                failed = False
+            finally:
+                record_call(name, time.perf_counter() - started, payload_size(args), payload_size(result), failed)
+    else:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result, failed = None, True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_call(name, time.perf_counter() - started, payload_size(args), payload_size(result), failed)
+    return wrapper
+
+def stats_snapshot():
+    """Per-handler counters and latency percentiles (seconds) as plain data."""
+    with stats_lock:
+        snapshot = {}
+        for name, stats in sorted(handler_stats.items()):
+            snapshot[name] = {
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+                "mean": stats["total"] / stats["calls"],
+                "p50": percentile(stats, 0.50),
+                "p95": percentile(stats, 0.95),
+                "p99": percentile(stats, 0.99),
+                "max": stats["max"]
+            }
+    return snapshot
+
+def format_stats():
+    """Markdown table of handler statistics for the Stats tab."""
+    snapshot = stats_snapshot()
+    startup = f"**Startup:** {format_startup_report()}\n\n"
+    if not snapshot:
+        return startup + "No calls recorded yet."
+    rows = ["| Handler | Calls | Errors | In | Out | p50 (ms) | p95 (ms) | p99 (ms) | Max (ms) |",
+            "|---|---:|---:|---:|---:|---:|---:|---:|---:|"]
+    for name, stats in snapshot.items():
+        rows.append(
+            f"| `{name}` | {stats['calls']} | {stats['errors']} | {stats['bytes_in']:,} | {stats['bytes_out']:,} | "
+            f"{stats['p50'] * 1000:.2f} | {stats['p95'] * 1000:.2f} | {stats['p99'] * 1000:.2f} | {stats['max'] * 1000:.2f} |"
+        )
+    return startup + "\n".join(rows)
+
+def dump_stats():
+    """Write the statistics to exports/stats.json for scrapers and return them as JSON."""
+    data = json.dumps({"generated_at": datetime.now().isoformat(), "startup": startup_report, "handlers": stats_snapshot()}, indent=2)
+    try:
+        export_dir = os.path.join(extension_dir, "exports")
+        os.makedirs(export_dir, exist_ok=True)
+        export_path = os.path.join(export_dir, "stats.json")
+        atomic_write(export_path, data)
+        return data, f"✅ Written to {export_path}"
+    except Exception as e:
+        return data, f"❌ Could not write stats: {e}"
+
+def reset_stats():
+    """Clear all recorded statistics."""
+    with stats_lock:
+        handler_stats.clear()
+    return format_stats()
+
+# Time every tokenizer call, wherever it comes from
+encode = instrumented(encode, "encode")
+
+@contextmanager
+def startup_phase(name):
+    """Time one phase of setup() for the startup report."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_report["phases"][name] = time.perf_counter() - started
+
+def format_startup_report():
+    """One line summarizing where startup time went."""
+    if startup_report["total"] is None:
+        return "Startup not timed yet."
+    phases = ", ".join(f"{name} {elapsed * 1000:.1f}" for name, elapsed in startup_report["phases"].items())
+    line = f"Started in {startup_report['total'] * 1000:.1f} ms ({phases})"
+    if startup_report["ui"] is not None:
+        line += f"; UI built in {startup_report['ui'] * 1000:.1f} ms"
+    if startup_report["search_index"] is not None:
+        line += f"; search index ready after {startup_report['search_index'] * 1000:.1f} ms"
+    return line
+
 def setup():
-    """Initialize the extension and load default files."""
-    global displayed_text, extension_dir, file_contents, bookmarks
+    """Initialize the extension; file contents and bookmarks load when first needed."""
+    global displayed_text, extension_dir, file_contents
     
+    started = time.perf_counter()
     extension_dir = os.path.dirname(__file__)
     
     # Create necessary directories
-    os.makedirs(os.path.join(extension_dir, "files"), exist_ok=True)
-    os.makedirs(os.path.join(extension_dir, "backups"), exist_ok=True)
+    with startup_phase("directories"):
+        os.makedirs(os.path.join(extension_dir, "files"), exist_ok=True)
+        os.makedirs(os.path.join(extension_dir, "backups"), exist_ok=True)
     
-    # Load default files
-    for filename in params["default_files"]:
-        file_path = os.path.join(extension_dir, "files", filename)
-        if not os.path.exists(file_path):
-            # Create default files if they don't exist
-            with open(file_path, "w", encoding="utf-8") as f:
-                if filename == "info.txt":
-                    f.write("# Text Manager Pro\n\nWelcome to the enhanced text management extension!")
-                elif filename == "notes.txt":
-                    f.write("# Notes\n\nYour notes go here...")
-                elif filename == "prompts.txt":
-                    f.write("# Prompt Templates\n\n## Translation\nTranslate the following to [LANGUAGE]:\n\n## Summary\nSummarize this text in 3 bullet points:")
-        
-        load_file_content(file_path)
+    # Create default files if they don't exist
+    with startup_phase("default files"):
+        for filename in params["default_files"]:
+            file_path = os.path.join(extension_dir, "files", filename)
+            if not os.path.exists(file_path):
+                with open(file_path, "w", encoding="utf-8") as f:
+                    if filename == "info.txt":
+                        f.write("# Text Manager Pro\n\nWelcome to the enhanced text management extension!")
+                    elif filename == "notes.txt":
+                        f.write("# Notes\n\nYour notes go here...")
+                    elif filename == "prompts.txt":
+                        f.write("# Prompt Templates\n\n## Translation\nTranslate the following to [LANGUAGE]:\n\n## Summary\nSummarize this text in 3 bullet points:")
+    
+    # First start on the SQLite backend: bring the plain-file workspace across,
+    # default files included, so they are stored documents like any other
+    if use_sqlite() and db_meta("imported_at") is None:
+        with startup_phase("workspace import"):
+            print(f"Text Manager Pro: {import_workspace_to_sqlite()}")
+    
+    with startup_phase("backup migration"):
+        migrate_legacy_backups()
     
-    # Load bookmarks if exists
-    bookmarks_path = os.path.join(extension_dir, "bookmarks.json")
-    if os.path.exists(bookmarks_path):
-        with open(bookmarks_path, "r") as f:
-            bookmarks = json.load(f)
+    with startup_phase("file listing"):
+        load_file_listing()
+        get_file_list()
     
-    # Set default displayed text
-    default_file = os.path.join(extension_dir, "files", params["default_files"][0])
-    if os.path.exists(default_file):
-        with open(default_file, "r", encoding="utf-8") as f:
-            displayed_text = f.read()
+    # Set default displayed text; the only file read at startup
+    with startup_phase("default file"):
+        default_file = os.path.join(extension_dir, "files", params["default_files"][0])
+        if os.path.exists(default_file):
+            displayed_text = load_file_content(default_file)
+    
+    # The search index builds in the background (the watcher starts once it is
+    # ready) and bookmarks load on first use
+    with startup_phase("background tasks"):
+        start_index_build()
+        if params["retention_enabled"]:
+            start_retention()
+    
+    startup_report["total"] = time.perf_counter() - started
+    print(f"Text Manager Pro: {format_startup_report()}")
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
 
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+def get_file_lock(file_path):
+    """The lock guarding one file, created on first use."""
+    with file_locks_guard:
+        lock = file_locks.get(file_path)
+        if lock is None:
+            lock = file_locks[file_path] = ReadWriteLock()
+        return lock
+
+@contextmanager
+def read_locked(file_path):
+    lock = get_file_lock(file_path)
+    lock.acquire_read()
+    try:
+        yield
+    finally:
+        lock.release_read()
+
+@contextmanager
+def write_locked(file_path):
+    lock = get_file_lock(file_path)
+    lock.acquire_write()
+    try:
+        yield
+    finally:
+        lock.release_write()
+
+def new_session():
+    """Editor state for one browser session."""
+    default_file = params["default_files"][0]
+    file_path = os.path.join(extension_dir, "files", default_file)
+    return {
+        "current_file": default_file if file_path in file_contents else None,
+        "displayed_text": displayed_text,
+        "editor_text": displayed_text,
+        "edit_version": 0,
+        "tab_versions": {"processing": 0, "templates": 0},
+        "version": last_modified.get(file_path),
+        "window": None,
+        "dirty": False,
+        "search": None,
+        "auto_save": params["auto_save"],
+        "autosave_error": None,
+        "seen_seq": watcher_state["seq"]
+    }
+
+@instrumented
 def load_file_content(file_path):
     """Load file content and track modification time."""
     global file_contents, last_modified
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        with read_locked(file_path):
+            mtime = os.path.getmtime(file_path)
+            stored = use_sqlite() and os.path.dirname(file_path) == os.path.join(extension_dir, "files")
+            content = get_document(os.path.basename(file_path), mtime) if stored else None
+            if content is None:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                if stored:
+                    put_document(os.path.basename(file_path), content, mtime)
             file_contents[file_path] = content
-            last_modified[file_path] = os.path.getmtime(file_path)
+            last_modified[file_path] = mtime
+            if os.path.dirname(file_path) == os.path.join(extension_dir, "files"):
+                record_line_count(os.path.basename(file_path), content, mtime)
             return content
     except Exception as e:
         return f"Error loading file: {e}"
 
+def make_delta(old_content, new_content):
+    """Build a reverse delta that rebuilds old_content from new_content."""
+    old_lines = old_content.splitlines(keepends=True)
+    new_lines = new_content.splitlines(keepends=True)
+    delta = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(new_lines, old_lines):
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append("".join(old_lines[j1:j2]))
+    return delta
+
+def apply_delta(delta, new_content):
+    """Rebuild an older version from a newer one and its reverse delta."""
+    new_lines = new_content.splitlines(keepends=True)
+    parts = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(new_lines[op[0]:op[1]])
+    return "".join(parts)
+
 def save_to_history(content, filename):
     """Save content to history for undo functionality."""
-    global text_history
-    text_history.append({
-        "content": content,
-        "filename": filename,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    entry = text_history.setdefault(filename, {"latest": None, "next_id": 1, "versions": []})
+    versions = entry["versions"]
+    if entry["latest"] == content:
+        return
+
+    # The previous head becomes a reverse delta, or a keyframe every N versions
+    if versions:
+        head = versions[-1]
+        if head["id"] % params["history_keyframe_interval"] == 0:
+            head["full"] = entry["latest"]
+        else:
+            head["delta"] = make_delta(entry["latest"], content)
+
+    versions.append({
+        "id": entry["next_id"],
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "size": len(content),
+        "full": None,
+        "delta": None
     })
-    if len(text_history) > params["max_history"]:
-        text_history.pop(0)
+    entry["next_id"] += 1
+    entry["latest"] = content
+    if len(versions) > params["max_history"]:
+        del versions[:len(versions) - params["max_history"]]
+
+def get_history_version(filename, version_id):
+    """Reconstruct a stored version from the nearest newer keyframe."""
+    if use_sqlite():
+        return db_read_version(filename, version_id)
+    entry = text_history.get(filename)
+    if not entry:
+        return None
+    versions = entry["versions"]
+    positions = {v["id"]: i for i, v in enumerate(versions)}
+    if version_id not in positions:
+        return None
 
-def save_text(content, filename, create_backup=True):
-    """Save text to file with optional backup."""
+    start = positions[version_id]
+    base = len(versions) - 1
+    for i in range(start, len(versions) - 1):
+        if versions[i]["full"] is not None:
+            base = i
+            break
+    content = entry["latest"] if base == len(versions) - 1 else versions[base]["full"]
+    for i in range(base - 1, start - 1, -1):
+        content = versions[i]["full"] if versions[i]["full"] is not None else apply_delta(versions[i]["delta"], content)
+    return content
+
+def list_history(filename):
+    """List stored versions of a file for the History tab."""
+    if use_sqlite() and filename:
+        rows = db().execute(
+            "SELECT id, timestamp, size FROM versions WHERE document = ? ORDER BY id DESC LIMIT ?",
+            (filename, params["max_history"])
+        ).fetchall()
+        choices = [f"v{row[0]} · {format_backup_timestamp(row[1])} ({row[2]} bytes)" for row in rows]
+    else:
+        entry = text_history.get(filename) if filename else None
+        choices = [f"v{v['id']} · {v['timestamp']} ({v['size']} chars)" for v in reversed(entry["versions"])] if entry else []
+    if not choices:
+        empty = gr.update(choices=[], value=None)
+        return "### 📜 File History\n\nNo history available yet.", empty, empty
+
+    summary = f"### 📜 File History: {filename}\n\n{len(choices)} version(s) stored, newest first."
+    return summary, gr.update(choices=choices, value=None), gr.update(choices=choices, value=choices[0])
+
+def parse_version_choice(choice):
+    """Extract the version id from a History dropdown label."""
+    match = re.match(r"v(\d+)", choice or "")
+    return int(match.group(1)) if match else None
+
+def compare_history_versions(filename, old_choice, new_choice):
+    """Diff two stored versions of a file."""
+    old_id, new_id = parse_version_choice(old_choice), parse_version_choice(new_choice)
+    if not filename or old_id is None or new_id is None:
+        return ""
+    old_content = get_history_version(filename, old_id)
+    new_content = get_history_version(filename, new_id)
+    if old_content is None or new_content is None:
+        return "Version not found"
+    return render_hunks(diff_hunks(old_content, new_content), f"v{old_id}", f"v{new_id}")
+
+def restore_version(filename, choice):
+    """Load a stored version into the editor; it is written on the next save."""
+    version_id = parse_version_choice(choice)
+    content = get_history_version(filename, version_id) if filename and version_id is not None else None
+    if content is None:
+        return gr.update(), "❌ Select a version to restore"
+    return content, f"♻️ Restored v{version_id} of {filename} into the editor. Save to keep it."
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    document TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    source_mtime REAL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS versions_by_document ON versions (document, timestamp);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id TEXT PRIMARY KEY,
+    document TEXT NOT NULL,
+    name TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    preview TEXT,
+    created TEXT,
+    anchor TEXT
+);
+CREATE INDEX IF NOT EXISTS bookmarks_by_document ON bookmarks (document, line);
+CREATE TABLE IF NOT EXISTS trash (
+    id INTEGER PRIMARY KEY,
+    document TEXT NOT NULL,
+    deleted_at TEXT NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trash_by_document ON trash (document, deleted_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def use_sqlite(backend=None):
+    """Whether a storage call should go to the SQLite store rather than the plain-file layout."""
+    return (backend or params["storage_backend"]) == "sqlite"
+
+def db():
+    """This thread's connection to the workspace database, opened in WAL mode on first use."""
+    local = db_state["local"]
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(os.path.join(extension_dir, params["database"]), timeout=30, isolation_level=None)
+        # WAL lets readers carry on while a save commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(DB_SCHEMA)
+        local.conn = conn
+        local.depth = 0
+    return conn
+
+@contextmanager
+def db_transaction():
+    """One write transaction; nested uses join the outermost one."""
+    conn = db()
+    local = db_state["local"]
+    if local.depth:
+        local.depth += 1
+        try:
+            yield conn
+        finally:
+            local.depth -= 1
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    local.depth = 1
     try:
-        file_path = os.path.join(extension_dir, "files", filename)
-        
-        # Create backup if requested
-        if create_backup and os.path.exists(file_path):
-            backup_dir = os.path.join(extension_dir, "backups")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"{filename}.{timestamp}.bak")
-            with open(file_path, "r", encoding="utf-8") as f:
-                backup_content = f.read()
-            with open(backup_path, "w", encoding="utf-8") as f:
-                f.write(backup_content)
-        
-        # Save new content
-        with open(file_path, "w", encoding="utf-8") as f:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+    finally:
+        local.depth = 0
+
+def storage_transaction():
+    """A database transaction on the SQLite backend; nothing on the plain-file one."""
+    return db_transaction() if use_sqlite() else nullcontext()
+
+def db_meta(key, value=None):
+    """Read a meta value, or set it when value is given."""
+    if value is None:
+        row = db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    with db_transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    return value
+
+def get_document(name, mtime=None):
+    """Stored text of a document, or None if missing or older than mtime."""
+    row = db().execute("SELECT content, mtime FROM documents WHERE name = ?", (name,)).fetchone()
+    if row is None or (mtime is not None and row[1] != mtime):
+        return None
+    return row[0]
+
+def put_document(name, content, mtime):
+    """Insert or replace a document."""
+    with db_transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (name, content, mtime, size, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (name, content, mtime, len(content), datetime.now().isoformat())
+        )
+
+def db_store_version(filename, data, timestamp, source_mtime):
+    """Add a compressed version row."""
+    with db_transaction() as conn:
+        conn.execute(
+            "INSERT INTO versions (document, timestamp, source_mtime, size, sha256, content) VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, timestamp, source_mtime, len(data), hashlib.sha256(data).hexdigest(), zlib.compress(data, 6))
+        )
+
+def db_read_version(filename, version_id):
+    """Text of one version row, checked against its hash."""
+    row = db().execute("SELECT content, sha256 FROM versions WHERE id = ? AND document = ?", (version_id, filename)).fetchone()
+    if row is None:
+        return None
+    data = zlib.decompress(row[0])
+    if hashlib.sha256(data).hexdigest() != row[1]:
+        raise ValueError(f"Version {version_id} of {filename} is corrupted")
+    return data.decode("utf-8")
+
+def format_backup_timestamp(timestamp):
+    """Show a backup id such as 20240101_120000_000000 as a readable time."""
+    try:
+        return datetime.strptime(timestamp[:15], "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return timestamp
+
+def import_workspace_to_sqlite():
+    """Copy files/, the backup store, bookmarks and trash/ into the SQLite store, skipping what is already there."""
+    counts = {"documents": 0, "versions": 0, "bookmarks": 0, "trash": 0}
+    try:
+        with db_transaction() as conn:
+            for filename, (mtime, _) in scan_files_dir().items():
+                with open(os.path.join(extension_dir, "files", filename), "r", encoding="utf-8") as f:
+                    put_document(filename, f.read(), mtime)
+                counts["documents"] += 1
+
+            manifests_dir = os.path.join(extension_dir, "backups", "manifests")
+            for filename in sorted(os.listdir(manifests_dir)) if os.path.isdir(manifests_dir) else []:
+                known = {row[0] for row in conn.execute("SELECT timestamp FROM versions WHERE document = ?", (filename,))}
+                for backup_id in list_backups(filename, backend="files"):
+                    if backup_id in known:
+                        continue
+                    manifest = read_backup_manifest(filename, backup_id, backend="files")
+                    data = read_backup(filename, backup_id, backend="files").encode("utf-8")
+                    db_store_version(filename, data, backup_id, manifest.get("source_mtime"))
+                    counts["versions"] += 1
+
+            trash_dir = os.path.join(extension_dir, "trash")
+            trashed = re.compile(r"^(.+)\.(\d{8}_\d{6})$")
+            for name in sorted(os.listdir(trash_dir)) if os.path.isdir(trash_dir) else []:
+                match = trashed.match(name)
+                if not match or conn.execute("SELECT 1 FROM trash WHERE document = ? AND deleted_at = ?", match.groups()).fetchone():
+                    continue
+                with open(os.path.join(trash_dir, name), "rb") as f:
+                    conn.execute("INSERT INTO trash (document, deleted_at, content) VALUES (?, ?, ?)",
+                                 (*match.groups(), zlib.compress(f.read(), 6)))
+                counts["trash"] += 1
+
+            with bookmarks_lock:
+                load_bookmarks(backend="files")
+                ops = [{"op": "add", "file": filename, "bookmark": bookmark}
+                       for filename, items in bookmarks.items() for bookmark in items]
+                db_write_bookmark_ops(ops)
+                counts["bookmarks"] = len(ops)
+            db_meta("imported_at", datetime.now().isoformat())
+    except Exception as e:
+        return f"❌ Import failed: {e}"
+    finally:
+        load_bookmarks()
+    return "✅ Imported into SQLite: " + ", ".join(f"{count} {kind}" for kind, count in counts.items())
+
+def export_sqlite_to_files():
+    """Write the SQLite store back out as files/, backup manifests, bookmarks.json and trash/."""
+    counts = {"documents": 0, "versions": 0, "bookmarks": 0, "trash": 0}
+    try:
+        conn = db()
+        for name, content in conn.execute("SELECT name, content FROM documents").fetchall():
+            file_path = os.path.join(extension_dir, "files", name)
+            with write_locked(file_path):
+                if os.path.exists(file_path):
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        if f.read() == content:
+                            continue
+                atomic_write(file_path, content)
+            index_file(name, content)
+            update_file_list_entry(name)
+            counts["documents"] += 1
+
+        for filename, in conn.execute("SELECT DISTINCT document FROM versions").fetchall():
+            known = set(list_backups(filename, backend="files"))
+            for timestamp, source_mtime, data in conn.execute(
+                    "SELECT timestamp, source_mtime, content FROM versions WHERE document = ? ORDER BY id", (filename,)):
+                if timestamp not in known:
+                    store_backup(filename, zlib.decompress(data), timestamp, source_mtime, backend="files")
+                    counts["versions"] += 1
+
+        trash_dir = os.path.join(extension_dir, "trash")
+        os.makedirs(trash_dir, exist_ok=True)
+        for document, deleted_at, data in conn.execute("SELECT document, deleted_at, content FROM trash").fetchall():
+            trash_path = os.path.join(trash_dir, f"{document}.{deleted_at}")
+            if not os.path.exists(trash_path):
+                with open(trash_path, "wb") as f:
+                    f.write(zlib.decompress(data))
+                counts["trash"] += 1
+
+        with bookmarks_lock:
+            load_bookmarks(backend="sqlite")
+            compact_bookmarks()
+            counts["bookmarks"] = sum(len(items) for items in bookmarks.values())
+    except Exception as e:
+        return f"❌ Export failed: {e}"
+    finally:
+        load_bookmarks()
+    return "✅ Exported to files: " + ", ".join(f"{count} {kind}" for kind, count in counts.items())
+
+def chunk_content(data):
+    """Split bytes into content-defined chunks, cutting after lines whose hash hits a boundary."""
+    min_size = params["backup_chunk_min"]
+    max_size = params["backup_chunk_max"]
+    chunk = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        while len(line) > max_size:
+            if chunk:
+                yield b"".join(chunk)
+                chunk, size = [], 0
+            yield line[:max_size]
+            line = line[max_size:]
+        chunk.append(line)
+        size += len(line)
+        if size >= max_size or (size >= min_size and zlib.crc32(line) & 0x1F == 0):
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+def backup_manifest_dir(filename):
+    """Directory holding the backup manifests of one file."""
+    return os.path.join(extension_dir, "backups", "manifests", filename)
+
+def store_backup(filename, content, timestamp=None, source_mtime=None, backend=None):
+    """Store a version in the deduplicated backup store; only new chunks are written."""
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    if use_sqlite(backend):
+        timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        db_store_version(filename, data, timestamp, source_mtime)
+        return timestamp
+    chunks_dir = os.path.join(extension_dir, "backups", "chunks")
+    hashes = []
+    # Held until the manifest exists, so the chunk sweeper never sees a chunk without its reference
+    with backup_store_lock:
+        for chunk in chunk_content(data):
+            digest = hashlib.sha256(chunk).hexdigest()
+            hashes.append(digest)
+            chunk_path = os.path.join(chunks_dir, digest[:2], digest + ".z")
+            if not os.path.exists(chunk_path):
+                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                tmp_path = chunk_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(zlib.compress(chunk, 6))
+                os.replace(tmp_path, chunk_path)
+
+        timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        manifest = {
+            "filename": filename,
+            "timestamp": timestamp,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "source_mtime": source_mtime,
+            "chunks": hashes
+        }
+        manifest_dir = backup_manifest_dir(filename)
+        os.makedirs(manifest_dir, exist_ok=True)
+        manifest_path = os.path.join(manifest_dir, f"{timestamp}.json")
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return timestamp
+
+def list_backups(filename, backend=None):
+    """List backup version ids of a file, oldest first."""
+    if use_sqlite(backend):
+        return [row[0] for row in db().execute(
+            "SELECT timestamp FROM versions WHERE document = ? ORDER BY timestamp", (filename,))]
+    manifest_dir = backup_manifest_dir(filename)
+    if not os.path.isdir(manifest_dir):
+        return []
+    return sorted(name[:-5] for name in os.listdir(manifest_dir) if name.endswith(".json"))
+
+def read_backup_manifest(filename, backup_id, backend=None):
+    """Read one backup manifest."""
+    if use_sqlite(backend):
+        row = db().execute(
+            "SELECT timestamp, size, sha256, source_mtime FROM versions WHERE document = ? AND timestamp = ? ORDER BY id DESC",
+            (filename, backup_id)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"No backup {backup_id} of {filename}")
+        return {"filename": filename, "timestamp": row[0], "size": row[1], "sha256": row[2], "source_mtime": row[3]}
+    with open(os.path.join(backup_manifest_dir(filename), f"{backup_id}.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_backup(filename, backup_id, backend=None):
+    """Reassemble a backed-up version from its chunks."""
+    if use_sqlite(backend):
+        row = db().execute(
+            "SELECT id FROM versions WHERE document = ? AND timestamp = ? ORDER BY id DESC", (filename, backup_id)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"No backup {backup_id} of {filename}")
+        return db_read_version(filename, row[0])
+    manifest = read_backup_manifest(filename, backup_id, backend)
+    chunks_dir = os.path.join(extension_dir, "backups", "chunks")
+    parts = []
+    for digest in manifest["chunks"]:
+        with open(os.path.join(chunks_dir, digest[:2], digest + ".z"), "rb") as f:
+            parts.append(zlib.decompress(f.read()))
+    data = b"".join(parts)
+    if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        raise ValueError(f"Backup {backup_id} of {filename} is corrupted")
+    return data.decode("utf-8")
+
+def migrate_legacy_backups():
+    """Move old per-save .bak copies into the chunk store."""
+    backup_dir = os.path.join(extension_dir, "backups")
+    legacy = re.compile(r"^(.+)\.(\d{8}_\d{6})\.bak$")
+    try:
+        names = os.listdir(backup_dir)
+    except OSError:
+        return
+    migrated = 0
+    for name in sorted(names):
+        match = legacy.match(name)
+        if not match:
+            continue
+        bak_path = os.path.join(backup_dir, name)
+        try:
+            with open(bak_path, "rb") as f:
+                data = f.read()
+            store_backup(match.group(1), data, timestamp=f"{match.group(2)}_000000")
+            os.remove(bak_path)
+            migrated += 1
+        except OSError as e:
+            print(f"Text Manager Pro: could not migrate backup {name}: {e}")
+    if migrated:
+        print(f"Text Manager Pro: migrated {migrated} legacy backup(s) into the chunk store")
+
+def backup_time(backup_id):
+    """When a backup or trash entry was made, from its timestamp id."""
+    try:
+        return datetime.strptime(backup_id[:15], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return datetime.min
+
+def retained_versions(stamps):
+    """Keys to keep from (key, time) pairs sorted newest first.
+
+    Keeps the newest retention_keep_last, plus the newest version in each of
+    the last retention_hourly hours, retention_daily days and
+    retention_weekly weeks that have versions at all.
+    """
+    keep = {key for key, _ in stamps[:params["retention_keep_last"]]}
+    for bucket_format, count in (("%Y%m%d%H", params["retention_hourly"]),
+                                 ("%Y%m%d", params["retention_daily"]),
+                                 ("%G%V", params["retention_weekly"])):
+        buckets = set()
+        for key, when in stamps:
+            if len(buckets) >= count:
+                break
+            bucket = when.strftime(bucket_format)
+            if bucket not in buckets:
+                buckets.add(bucket)
+                keep.add(key)
+    return keep
+
+def scan_backup_manifests(report):
+    """Bring the manifest cache up to date, reading only manifests added since the last scan.
+
+    Returns False if some manifest could not be read, in which case chunks
+    must not be swept.
+    """
+    manifests_dir = os.path.join(extension_dir, "backups", "manifests")
+    cache = retention_state["manifests"]
+    try:
+        with os.scandir(manifests_dir) as it:
+            filenames = {entry.name for entry in it if entry.is_dir()}
+    except OSError:
+        filenames = set()
+    for filename in set(cache) - filenames:
+        del cache[filename]
+    complete = True
+    for filename in filenames:
+        known = cache.setdefault(filename, {})
+        current = set(list_backups(filename, backend="files"))
+        for backup_id in set(known) - current:
+            del known[backup_id]
+        for backup_id in current - set(known):
+            try:
+                known[backup_id] = read_backup_manifest(filename, backup_id, backend="files")["chunks"]
+                report["manifests_read"] += 1
+            except (OSError, ValueError, KeyError):
+                complete = False
+    return complete
+
+def chunk_size(chunks_dir, digest):
+    """On-disk size of a chunk, cached since chunks never change."""
+    sizes = retention_state["chunk_sizes"]
+    if digest not in sizes:
+        try:
+            sizes[digest] = os.path.getsize(os.path.join(chunks_dir, digest[:2], digest + ".z"))
+        except OSError:
+            sizes[digest] = 0
+    return sizes[digest]
+
+def prune_backup_store(report, dry_run):
+    """Apply the retention policy and size quota to the chunk store, then sweep unreferenced chunks."""
+    chunks_dir = os.path.join(extension_dir, "backups", "chunks")
+    with backup_store_lock:
+        complete = scan_backup_manifests(report)
+        cache = retention_state["manifests"]
+        # Work on a copy so a dry run leaves the cache matching the disk
+        remaining = {filename: dict(backups) for filename, backups in cache.items()}
+        refcounts = {}
+        for backups in remaining.values():
+            for chunks in backups.values():
+                for digest in chunks:
+                    refcounts[digest] = refcounts.get(digest, 0) + 1
+
+        def drop(filename, backup_id):
+            for digest in remaining[filename].pop(backup_id):
+                refcounts[digest] -= 1
+                if not refcounts[digest]:
+                    del refcounts[digest]
+            report["versions"] += 1
+            if not dry_run:
+                os.remove(os.path.join(backup_manifest_dir(filename), f"{backup_id}.json"))
+                del cache[filename][backup_id]
+
+        for filename, backups in remaining.items():
+            stamps = [(backup_id, backup_time(backup_id)) for backup_id in sorted(backups, reverse=True)]
+            keep = retained_versions(stamps)
+            for backup_id, _ in stamps:
+                if backup_id not in keep:
+                    drop(filename, backup_id)
+
+        # Over quota: drop the oldest remaining versions, never a file's newest
+        live = sum(chunk_size(chunks_dir, digest) for digest in refcounts)
+        if live > params["retention_max_bytes"]:
+            candidates = sorted(
+                (backup_id, filename) for filename, backups in remaining.items()
+                for backup_id in sorted(backups)[:-1]
+            )
+            for backup_id, filename in candidates:
+                if live <= params["retention_max_bytes"]:
+                    break
+                chunks = set(remaining[filename][backup_id])
+                drop(filename, backup_id)
+                live -= sum(chunk_size(chunks_dir, digest) for digest in chunks if digest not in refcounts)
+
+        if not complete:
+            print("Text Manager Pro: retention skipped the chunk sweep because a manifest could not be read")
+            return
+
+        # Sweep chunks no manifest refers to any more
+        try:
+            prefixes = [entry.path for entry in os.scandir(chunks_dir) if entry.is_dir()]
+        except OSError:
+            prefixes = []
+        for prefix in prefixes:
+            with os.scandir(prefix) as it:
+                for entry in it:
+                    if not entry.name.endswith(".z") or entry.name[:-2] in refcounts:
+                        continue
+                    report["chunks"] += 1
+                    report["bytes"] += entry.stat().st_size
+                    if not dry_run:
+                        os.remove(entry.path)
+                        retention_state["chunk_sizes"].pop(entry.name[:-2], None)
+
+def prune_database(report, dry_run):
+    """Apply the retention policy and size quota to the versions table."""
+    conn = db()
+    rows = conn.execute("SELECT id, document, timestamp, length(content) FROM versions ORDER BY document, timestamp DESC").fetchall()
+    by_document = {}
+    for version_id, document, timestamp, size in rows:
+        by_document.setdefault(document, []).append((version_id, backup_time(timestamp), size))
+    doomed = set()
+    for document, versions in by_document.items():
+        keep = retained_versions([(version_id, when) for version_id, when, _ in versions])
+        doomed.update(version_id for version_id, _, _ in versions if version_id not in keep)
+    sizes = {version_id: size for version_id, _, _, size in rows}
+    live = sum(size for version_id, size in sizes.items() if version_id not in doomed)
+    if live > params["retention_max_bytes"]:
+        newest = {versions[0][0] for versions in by_document.values()}
+        for version_id, _, timestamp, _ in sorted(rows, key=lambda row: row[2]):
+            if live <= params["retention_max_bytes"]:
+                break
+            if version_id not in doomed and version_id not in newest:
+                doomed.add(version_id)
+                live -= sizes[version_id]
+    report["versions"] += len(doomed)
+    report["bytes"] += sum(sizes[version_id] for version_id in doomed)
+    if doomed and not dry_run:
+        with db_transaction() as conn:
+            conn.executemany("DELETE FROM versions WHERE id = ?", [(version_id,) for version_id in doomed])
+
+def prune_trash(report, dry_run):
+    """Delete trash older than trash_max_age_days, then the oldest entries beyond trash_max_bytes."""
+    cutoff = datetime.now().timestamp() - params["trash_max_age_days"] * 86400
+    if use_sqlite():
+        entries = [(row[1], row[0], row[2]) for row in db().execute(
+            "SELECT id, deleted_at, length(content) FROM trash ORDER BY deleted_at")]
+    else:
+        trash_dir = os.path.join(extension_dir, "trash")
+        trashed = re.compile(r"^.+\.(\d{8}_\d{6})$")
+        entries = []
+        try:
+            with os.scandir(trash_dir) as it:
+                for entry in it:
+                    match = trashed.match(entry.name)
+                    if match and entry.is_file():
+                        entries.append((match.group(1), entry.path, entry.stat().st_size))
+        except OSError:
+            pass
+        entries.sort()
+    total = sum(size for _, _, size in entries)
+    doomed = []
+    for deleted_at, key, size in entries:
+        if backup_time(deleted_at).timestamp() < cutoff or total > params["trash_max_bytes"]:
+            doomed.append(key)
+            total -= size
+            report["trash"] += 1
+            report["bytes"] += size
+    if doomed and not dry_run:
+        if use_sqlite():
+            with db_transaction() as conn:
+                conn.executemany("DELETE FROM trash WHERE id = ?", [(key,) for key in doomed])
+        else:
+            for path in doomed:
+                os.remove(path)
+
+def run_retention(dry_run=None):
+    """Prune backups and trash once and return a report of what was (or would be) reclaimed."""
+    dry_run = params["retention_dry_run"] if dry_run is None else dry_run
+    report = {"dry_run": dry_run, "versions": 0, "chunks": 0, "trash": 0, "bytes": 0,
+              "manifests_read": 0, "started_at": datetime.now().isoformat()}
+    started = time.time()
+    with retention_state["run_lock"]:
+        if use_sqlite():
+            prune_database(report, dry_run)
+        else:
+            prune_backup_store(report, dry_run)
+        prune_trash(report, dry_run)
+    report["seconds"] = round(time.time() - started, 3)
+    retention_state["last_report"] = report
+    return report
+
+def format_retention_report(report):
+    """One-line summary of a retention run."""
+    if report is None:
+        return "Retention has not run yet."
+    verb = "Would reclaim" if report["dry_run"] else "Reclaimed"
+    return (f"🧹 {verb} {report['bytes'] / 1048576:.1f} MB: {report['versions']} version(s), "
+            f"{report['chunks']} chunk(s), {report['trash']} trash item(s) "
+            f"({report['manifests_read']} new manifest(s) scanned, {report['seconds']}s, {report['started_at'][:19]})")
+
+def retention_loop():
+    """Prune on a timer until stopped."""
+    # Run at a lower CPU priority; on Linux this applies to this thread only
+    if sys.platform.startswith("linux") and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except OSError:
+            pass
+    stop = retention_state["stop"]
+    while not stop.wait(params["retention_interval"]):
+        try:
+            report = run_retention()
+            if report["bytes"] or report["versions"] or report["trash"]:
+                print(f"Text Manager Pro: {format_retention_report(report)}")
+        except Exception as e:
+            print(f"Text Manager Pro: retention error: {e}")
+
+def start_retention():
+    """Start the background retention thread if it is not running."""
+    thread = retention_state["thread"]
+    if thread is None or not thread.is_alive():
+        retention_state["stop"] = threading.Event()
+        retention_state["thread"] = threading.Thread(target=retention_loop, name="text-manager-retention", daemon=True)
+        retention_state["thread"].start()
+
+def atomic_write(file_path, content):
+    """Write through a synced temp file and rename it over the target."""
+    directory, name = os.path.split(file_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
             f.write(content)
-        
-        save_to_history(content, filename)
-        file_contents[file_path] = content
-        last_modified[file_path] = os.path.getmtime(file_path)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, os.stat(file_path).st_mode & 0o777)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@instrumented
+def save_text(content, filename, create_backup=True, expected_mtime=None, window=None):
+    """Save text to file with optional backup.
+
+    When expected_mtime is given the save is refused if the file changed on
+    disk since it was loaded, so concurrent sessions cannot overwrite each other.
+    """
+    if filename in large_files:
+        return save_window(filename, content, window)
+    try:
+        file_path = os.path.join(extension_dir, "files", filename)
+        with write_locked(file_path), storage_transaction():
+            if expected_mtime is not None and os.path.exists(file_path) and os.path.getmtime(file_path) != expected_mtime:
+                return f"❌ {filename} was changed elsewhere since you loaded it. Reload it, or use Save As.", content
+            
+            # Back up the on-disk version only if the store does not already hold it
+            if create_backup and os.path.exists(file_path):
+                backups = list_backups(filename)
+                head = read_backup_manifest(filename, backups[-1]) if backups else None
+                if head is None or head.get("source_mtime") != os.path.getmtime(file_path):
+                    with open(file_path, "rb") as f:
+                        store_backup(filename, f.read(), source_mtime=os.path.getmtime(file_path))
+            
+            # Keep the previous text so bookmarks can follow their lines
+            old_content = file_contents.get(file_path)
+            ensure_bookmarks()
+            if old_content is None and filename in bookmarks and os.path.exists(file_path):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    old_content = f.read()
+            
+            # Save new content
+            atomic_write(file_path, content)
+            
+            save_to_history(content, filename)
+            file_contents[file_path] = content
+            last_modified[file_path] = os.path.getmtime(file_path)
+            if create_backup:
+                store_backup(filename, content, source_mtime=last_modified[file_path])
+            if use_sqlite():
+                put_document(filename, content, last_modified[file_path])
+        remap_bookmarks(filename, old_content, content)
+        index_file(filename, content)
+        update_file_list_entry(filename)
+        update_file_token_count(filename, content)
         
         return f"✅ Saved to {filename} successfully!", content
     except Exception as e:
         return f"❌ Error saving file: {e}", content
 
-def load_file(filename):
+def saved_version(filename, window=None):
+    """The version stamp a session should hold after saving a file."""
+    if window is not None:
+        return window["mtime"]
+    return last_modified.get(os.path.join(extension_dir, "files", filename))
+
+def queue_autosave(filename, content, session):
+    """Queue editor content for the write-behind saver, merging rapid edits."""
+    now = time.monotonic()
+    with autosave_state["lock"]:
+        pending = autosave_queue.get(filename)
+        # The window and version the edit was made against, not whatever the session shows at save time
+        autosave_queue[filename] = {
+            "content": content,
+            "session": session,
+            "window": dict(session["window"]) if session["window"] is not None else None,
+            "version": session["version"],
+            "first": pending["first"] if pending else now,
+            "last": now
+        }
+        thread = autosave_state["thread"]
+        if thread is None or not thread.is_alive():
+            autosave_state["thread"] = threading.Thread(target=autosave_loop, name="text-manager-autosave", daemon=True)
+            autosave_state["thread"].start()
+    autosave_state["wake"].set()
+
+def flush_autosave(force=False):
+    """Save every queued file whose edits have settled (or all of them when forced)."""
+    now = time.monotonic()
+    with autosave_state["lock"]:
+        due = [
+            (filename, autosave_queue.pop(filename))
+            for filename, pending in list(autosave_queue.items())
+            if force
+            or now - pending["last"] >= params["autosave_interval"]
+            or now - pending["first"] >= params["autosave_max_delay"]
+        ]
+    for filename, pending in due:
+        run_autosave(filename, pending)
+    return len(due)
+
+def run_autosave(filename, pending):
+    """Save one queued edit against the window and version it was made on."""
+    session = pending["session"]
+    window = pending["window"]
+    status, _ = save_text(pending["content"], filename, expected_mtime=pending["version"], window=window)
+    if status.startswith("❌"):
+        print(f"Text Manager Pro: auto-save of {filename} failed: {status}")
+        message = f"❌ Auto-save of {filename} failed: {status.lstrip('❌ ')}"
+        if window is None:
+            # Keep the refused edit restorable from History rather than dropping it
+            try:
+                if use_sqlite():
+                    store_backup(filename, pending["content"])
+                else:
+                    save_to_history(pending["content"], filename)
+                message += " Your edit is kept in History."
+            except Exception:
+                pass
+        session["autosave_error"] = message
+        return status
+    # Only advance the session if it still shows what was saved
+    current = session["window"]
+    if session["current_file"] == filename and (window is None) == (current is None) \
+            and (window is None or current["start"] == window["start"]):
+        if window is not None:
+            session["window"] = window
+        session["version"] = saved_version(filename, window)
+        session["displayed_text"] = pending["content"]
+        session["dirty"] = session["editor_text"] != pending["content"]
+    return status
+
+def with_autosave_error(status, session):
+    """Prefix a handler's status with an auto-save failure the session has not been shown yet."""
+    error = session.get("autosave_error")
+    if not error:
+        return status
+    session["autosave_error"] = None
+    return error if not isinstance(status, str) or not status else f"{error}\n\n{status}"
+
+def flush_pending_autosave(filename):
+    """Save a file's queued edit now, before the session moves off the text it belongs to."""
+    with autosave_state["lock"]:
+        pending = autosave_queue.pop(filename, None)
+    if pending is None:
+        return None
+    return run_autosave(filename, pending)
+
+def autosave_loop():
+    """Background flusher for the auto-save queue."""
+    while True:
+        autosave_state["wake"].wait()
+        time.sleep(params["autosave_interval"] / 2)
+        flush_autosave()
+        with autosave_state["lock"]:
+            if not autosave_queue:
+                autosave_state["wake"].clear()
+
+def save_and_refresh(content, filename, session):
+    """Save from the UI and refresh the file dropdown labels."""
+    # An explicit save supersedes any pending auto-save of the same file
+    with autosave_state["lock"]:
+        autosave_queue.pop(filename, None)
+    own_file = filename == session["current_file"]
+    status, content = save_text(
+        content,
+        filename,
+        expected_mtime=session["version"] if own_file else None,
+        window=session["window"] if own_file else None
+    )
+    if own_file and status.startswith("✅"):
+        session.update(displayed_text=content, dirty=False, version=saved_version(filename, session["window"]))
+    return status, content, gr.update(choices=get_file_choices()), session
+
+def load_file(filename, session):
     """Load a file from the files directory."""
-    global current_file, displayed_text
     try:
+        if session["current_file"]:
+            flush_pending_autosave(session["current_file"])
         if filename:
             file_path = os.path.join(extension_dir, "files", filename)
+            if os.path.getsize(file_path) > params["large_file_threshold"]:
+                content, status, window = open_large_file(filename)
+                session.update(current_file=filename, displayed_text=content, dirty=False,
+                               window=window, version=window["mtime"])
+                show_in_editor(session, content)
+                return content, with_autosave_error(status, session), session
+            large_files.pop(filename, None)
             content = load_file_content(file_path)
-            current_file = filename
-            displayed_text = content
-            return content, f"📄 Loaded: {filename}"
-        return displayed_text, "No file selected"
+            session.update(current_file=filename, displayed_text=content, dirty=False,
+                           window=None, version=last_modified.get(file_path))
+            show_in_editor(session, content)
+            token_count = cached_file_token_count(filename)
+            if token_count is not None:
+                return content, with_autosave_error(f"📄 Loaded: {filename} ({token_count} tokens)", session), session
+            # Counted in the background; the dropdown label shows it once done
+            schedule_file_token_count(filename, content)
+            return content, with_autosave_error(f"📄 Loaded: {filename}", session), session
+        return session["displayed_text"], "No file selected", session
     except Exception as e:
-        return f"Error: {e}", f"❌ Failed to load {filename}"
+        return f"Error: {e}", f"❌ Failed to load {filename}", session
+
+def build_line_index(file_path, entry=None, from_offset=0):
+    """Count newlines per fixed-size block so any line can be located without a full scan."""
+    size = os.path.getsize(file_path)
+    if entry is None:
+        entry = {"block_offsets": [], "block_lines": []}
+    keep = bisect_left(entry["block_offsets"], from_offset - LINE_INDEX_BLOCK + 1)
+    block_offsets = entry["block_offsets"][:keep]
+    block_lines = entry["block_lines"][:keep]
+    offset = keep * LINE_INDEX_BLOCK
+    newlines = block_lines[-1] + entry["block_newlines"][keep - 1] if keep else 0
+    block_newlines = entry.get("block_newlines", [])[:keep]
+
+    if size:
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset < size:
+                count = mm[offset:offset + LINE_INDEX_BLOCK].count(b"\n")
+                block_offsets.append(offset)
+                block_lines.append(newlines)
+                block_newlines.append(count)
+                newlines += count
+                offset += LINE_INDEX_BLOCK
+
+    entry.update({
+        "path": file_path,
+        "size": size,
+        "mtime": os.path.getmtime(file_path),
+        "block_offsets": block_offsets,
+        "block_lines": block_lines,
+        "block_newlines": block_newlines,
+        "total_lines": newlines + 1
+    })
+    return entry
+
+def line_offset(entry, mm, line):
+    """Byte offset where a 0-based line starts."""
+    if line <= 0:
+        return 0
+    if line >= entry["total_lines"]:
+        return entry["size"]
+    # Find the block holding the newline that ends line - 1
+    block = bisect_left(entry["block_lines"], line) - 1
+    offset = entry["block_offsets"][block]
+    for _ in range(line - entry["block_lines"][block]):
+        offset = mm.find(b"\n", offset) + 1
+    return offset
+
+def read_window(filename, start):
+    """Read a window of lines from a large file; returns the text, a status and the window bounds."""
+    entry = large_files[filename]
+    with read_locked(entry["path"]):
+        start = max(0, min(start, entry["total_lines"] - 1))
+        end = min(start + params["window_lines"], entry["total_lines"])
+        if entry["size"]:
+            with open(entry["path"], "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                begin = line_offset(entry, mm, start)
+                finish = line_offset(entry, mm, end)
+                data = mm[begin:finish]
+        else:
+            begin = finish = 0
+            data = b""
+
+    # Keep the newline that separates the window from the next line out of the editor
+    trailing_newline = data.endswith(b"\n")
+    if trailing_newline:
+        data = data[:-1]
+    window = {
+        "start": start,
+        "end": end,
+        "begin": begin,
+        "finish": finish,
+        "trailing_newline": trailing_newline,
+        "mtime": entry["mtime"]
+    }
+    status = f"📄 {filename}: lines {start + 1}-{end} of {entry['total_lines']} (large-file mode)"
+    return data.decode("utf-8", errors="replace"), status, window
+
+def open_large_file(filename):
+    """Index a large file (unless already indexed and current) and show its first window."""
+    file_path = os.path.join(extension_dir, "files", filename)
+    entry = large_files.get(filename)
+    if entry is None or entry["mtime"] != os.path.getmtime(file_path):
+        with read_locked(file_path):
+            large_files[filename] = build_line_index(file_path)
+    return read_window(filename, 0)
+
+def move_window(session, start):
+    """Show another window of the session's large file."""
+    filename = session["current_file"]
+    if filename not in large_files or session["window"] is None:
+        return gr.update(), "Paging is only available in large-file mode", session
+    flush_pending_autosave(filename)
+    content, status, window = read_window(filename, start)
+    session.update(displayed_text=content, dirty=False, window=window, version=window["mtime"])
+    show_in_editor(session, content)
+    return content, with_autosave_error(status, session), session
+
+def page_window(session, direction):
+    """Move the large-file window one page forward or back."""
+    window = session["window"]
+    start = window["start"] + direction * params["window_lines"] if window else 0
+    return move_window(session, start)
+
+def jump_to_line(session, line_number):
+    """Move the large-file window so it starts at the given 1-based line."""
+    return move_window(session, int(line_number or 1) - 1)
+
+def splice_file(file_path, begin, finish, data):
+    """Replace bytes [begin, finish) of a file and fsync it.
+
+    Same-length data is overwritten in place. Otherwise the whole file is streamed to a synced temp file
+    and renamed over the original, so a crash leaves the old file or the new one, never a half-shifted mix;
+    that costs a full copy of the file per save, which is why windows are never auto-saved."""
+    if finish - begin == len(data):
+        with open(file_path, "r+b") as f:
+            f.seek(begin)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return
+    directory, name = os.path.split(file_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with open(file_path, "rb") as src, open(fd, "wb") as dst:
+            remaining = begin
+            while remaining:
+                chunk = src.read(min(LINE_INDEX_BLOCK, remaining))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+            dst.write(data)
+            src.seek(finish)
+            while True:
+                chunk = src.read(LINE_INDEX_BLOCK)
+                if not chunk:
+                    break
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.chmod(tmp_path, os.stat(file_path).st_mode & 0o777)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def save_window(filename, content, window):
+    """Write the edited window back into its large file."""
+    entry = large_files[filename]
+    if window is None:
+        return f"❌ {filename} is in large-file mode; open a window of it before saving", content
+    try:
+        with write_locked(entry["path"]):
+            # Any other write shifts offsets, so the window must match the file exactly
+            if os.path.getmtime(entry["path"]) != window["mtime"] or entry["mtime"] != window["mtime"]:
+                return f"❌ {filename} changed on disk; reload the window before saving", content
+            data = content.encode("utf-8")
+            if window["trailing_newline"]:
+                data += b"\n"
+            splice_file(entry["path"], window["begin"], window["finish"], data)
+            build_line_index(entry["path"], entry, from_offset=window["begin"])
+        last_modified[entry["path"]] = entry["mtime"]
+        new_end = window["start"] + content.count("\n") + 1
+        window.update({"end": new_end, "finish": window["begin"] + len(data), "mtime": entry["mtime"]})
+        return f"✅ Saved lines {window['start'] + 1}-{new_end} of {filename}", content
+    except Exception as e:
+        return f"❌ Error saving window: {e}", content
+
+def compile_search(search_term, mode="Literal", case_sensitive=False, binary=False):
+    """Compiled pattern for a search, from the LRU cache; raises re.error for a bad regex."""
+    key = (search_term, mode, case_sensitive, binary)
+    with search_patterns_lock:
+        if key in search_patterns:
+            search_patterns.move_to_end(key)
+            return search_patterns[key]
+
+    if mode == "Regex":
+        source = search_term
+    elif mode == "Whole word":
+        source = rf"(?<!\w){re.escape(search_term)}(?!\w)"
+    else:
+        source = re.escape(search_term)
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    # Large files are searched as bytes, where \w and case folding are ASCII-only
+    pattern = re.compile(source.encode("utf-8") if binary else source, flags)
+
+    with search_patterns_lock:
+        search_patterns[key] = pattern
+        while len(search_patterns) > params["search_pattern_cache_size"]:
+            search_patterns.popitem(last=False)
+    return pattern
+
+def count_newlines(buffer, start, end):
+    """Newlines in buffer[start:end], for str, bytes or mmap buffers."""
+    if isinstance(buffer, str):
+        return buffer.count("\n", start, end)
+    return buffer[start:end].count(b"\n")
+
+def hit_record(buffer, start, end, line):
+    """Describe one match: 1-based line, column and length in characters, and a preview."""
+    newline = "\n" if isinstance(buffer, str) else b"\n"
+    line_begin = buffer.rfind(newline, 0, start) + 1
+    line_end = buffer.find(newline, end)
+    if line_end == -1:
+        line_end = len(buffer)
+    before, match, after = buffer[line_begin:start], buffer[start:end], buffer[end:line_end]
+    if not isinstance(buffer, str):
+        before, match, after = (part.decode("utf-8", errors="replace") for part in (before, match, after))
+    preview = before[-40:] + match[:80] + after[:40]
+    return {
+        "line": line,
+        "column": len(before),
+        "length": len(match),
+        "start": start,
+        "end": end,
+        "preview": preview.replace("`", "'").replace("\n", " ")
+    }
+
+def scan_matches(buffer, pattern, max_hits, interval=None):
+    """One finditer pass; yields (hits, total, done) as soon as there is something new to show.
+
+    The first hit and a full page of hits are reported immediately; after that
+    the running total is reported at most every interval seconds."""
+    hits, total = [], 0
+    line, last = 1, 0
+    shown = time.monotonic()
+    for match in pattern.finditer(buffer):
+        total += 1
+        if len(hits) < max_hits:
+            start, end = match.span()
+            line += count_newlines(buffer, last, start)
+            last = start
+            hits.append(hit_record(buffer, start, end, line))
+            if len(hits) in (1, max_hits):
+                shown = time.monotonic()
+                yield hits, total, False
+        elif interval and not total % 1024 and time.monotonic() - shown >= interval:
+            shown = time.monotonic()
+            yield hits, total, False
+    yield hits, total, True
+
+def next_match(buffer, pattern, after=None):
+    """The first match after a previous hit (or from the top), with its line number."""
+    position, line, last = (after["end"], after["line"], after["start"]) if after else (0, 1, 0)
+    for match in pattern.finditer(buffer, position):
+        start, end = match.span()
+        if after and (start, end) == (after["start"], after["end"]):
+            continue
+        return hit_record(buffer, start, end, line + count_newlines(buffer, last, start))
+    return None
+
+def format_search_hits(search_term, mode, hits, total, done):
+    """Markdown listing of in-file matches."""
+    if done and not total:
+        return f"No matches for `{search_term}` ({mode.lower()})"
+    lines = [f"### 🔎 {'Found' if done else 'Scanning...'} {total:,} match(es) for `{search_term}` ({mode.lower()})", ""]
+    lines.extend(f"- line {hit['line']}, col {hit['column'] + 1}: `{hit['preview']}`" for hit in hits)
+    if total > len(hits):
+        lines.append(f"\n*Showing the first {len(hits)}; use ⬇ Next to step past them*")
+    lines.append(f"\n---\n*{'Found' if done else 'Counted'} {total:,} occurrence(s){'' if done else ' so far'}*")
+    return "\n".join(lines)
+
+@instrumented
+def search_text(content, search_term, case_sensitive, mode="Literal"):
+    """Search text and list the matches with their line numbers."""
+    if not search_term:
+        return "Please enter a search term"
+    try:
+        pattern = compile_search(search_term, mode, case_sensitive)
+    except re.error as e:
+        return f"❌ Invalid regex: {e}"
+    for hits, total, done in scan_matches(content, pattern, params["search_max_hits"]):
+        pass
+    return format_search_hits(search_term, mode, hits, total, done)
+
+def tokenize_terms(text):
+    """Split text into lowercase search terms."""
+    return [term.lower() for term in WORD_RE.findall(text)]
+
+def unindex_file(filename):
+    """Remove a file from the workspace search index."""
+    with index_lock:
+        entry = indexed_files.pop(filename, None)
+        if entry is None:
+            return
+        for term in entry["postings"]:
+            files = search_index.get(term)
+            if files is not None:
+                files.pop(filename, None)
+                if not files:
+                    del search_index[term]
+        index_state["dirty"] = True
+
+def index_file(filename, content=None):
+    """Add or refresh a file in the workspace search index."""
+    file_path = os.path.join(extension_dir, "files", filename)
+    try:
+        if os.path.getsize(file_path) > params["large_file_threshold"]:
+            unindex_file(filename)
+            return
+        if content is None:
+            with read_locked(file_path):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+        mtime = os.path.getmtime(file_path)
+    except OSError:
+        unindex_file(filename)
+        return
+
+    postings = {}
+    for line_number, line in enumerate(content.split("\n"), start=1):
+        for term in set(tokenize_terms(line)):
+            postings.setdefault(term, []).append(line_number)
+
+    record_line_count(filename, content, mtime)
+    with index_lock:
+        unindex_file(filename)
+        indexed_files[filename] = {"mtime": mtime, "postings": postings}
+        for term, lines in postings.items():
+            search_index.setdefault(term, {})[filename] = lines
+        index_state["dirty"] = True
+    persist_search_index()
+
+def persist_search_index(force=False):
+    """Write the search index to disk, at most once per persist interval."""
+    if not index_state["dirty"] or not extension_dir:
+        return
+    now = time.time()
+    if not force and now - index_state["last_persist"] < params["index_persist_interval"]:
+        return
+    index_path = os.path.join(extension_dir, "search_index.json")
+    tmp_path = index_path + ".tmp"
+    try:
+        with index_lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "files": indexed_files}, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, index_path)
+            index_state["dirty"] = False
+            index_state["last_persist"] = now
+    except OSError as e:
+        print(f"Text Manager Pro: could not persist search index: {e}")
+
+def build_search_index():
+    """Load the persisted index and re-index only files changed since it was written."""
+    persisted = {}
+    index_path = os.path.join(extension_dir, "search_index.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == 1:
+                persisted = data["files"]
+        except (OSError, ValueError, KeyError):
+            persisted = {}
+    with index_lock:
+        search_index.clear()
+        indexed_files.clear()
+        for filename, entry in persisted.items():
+            indexed_files[filename] = entry
+            for term, lines in entry["postings"].items():
+                search_index.setdefault(term, {})[filename] = lines
+
+    current = set(get_file_list())
+    entries = file_list_cache["entries"] or {}
+    for filename in list(indexed_files):
+        if filename not in current:
+            unindex_file(filename)
+    for filename in current:
+        entry = indexed_files.get(filename)
+        if entry is None or filename not in entries or entry["mtime"] != entries[filename][0]:
+            index_file(filename)
+    persist_search_index(force=True)
+
+def start_index_build():
+    """Build the search index on a background thread; workspace searches wait for it."""
+    index_state["ready"].clear()
+    started = time.perf_counter()
+
+    def build():
+        try:
+            build_search_index()
+        except Exception as e:
+            print(f"Text Manager Pro: could not build search index: {e}")
+        finally:
+            index_state["ready"].set()
+            startup_report["search_index"] = time.perf_counter() - started
+        persist_file_listing()
+        # The watcher re-indexes changed files, so it waits for the index
+        if params["auto_refresh"]:
+            set_auto_refresh(True)
+
+    threading.Thread(target=build, name="text-manager-index", daemon=True).start()
+
+def read_lines(filename, line_numbers):
+    """Read specific 1-based lines of a file without keeping the rest."""
+    wanted = set(line_numbers)
+    found = {}
+    file_path = os.path.join(extension_dir, "files", filename)
+    if file_path in file_contents:
+        lines = file_contents[file_path].split("\n")
+        return {n: lines[n - 1] for n in wanted if n <= len(lines)}
+    last = max(wanted) if wanted else 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line_number in wanted:
+                found[line_number] = line.rstrip("\n")
+            if line_number >= last:
+                break
+    return found
+
+def search_all_files(search_term, case_sensitive=False, max_results=None):
+    """Query the workspace index and return ranked hits with line previews."""
+    terms = list(dict.fromkeys(tokenize_terms(search_term)))
+    if not terms:
+        return "Please enter a search term"
+    max_results = max_results or params["max_search_results"]
+    if not index_state["ready"].wait(timeout=60):
+        return "⏳ The search index is still loading, please try again shortly"
+
+    # Copy the postings so concurrent re-indexing cannot change them mid-query
+    with index_lock:
+        postings = [dict(search_index.get(term, {})) for term in terms]
+        indexed_count = len(indexed_files)
+    candidates = set(postings[0])
+    for files in postings[1:]:
+        candidates &= set(files)
+
+    # Fall back to matching any term when no file contains all of them
+    if not candidates:
+        candidates = set().union(*postings)
+    if not candidates:
+        return f"No matches for **{search_term}** in {indexed_count} file(s)"
+
+    # Rank by tf-idf over matching lines
+    total = max(indexed_count, 1)
+    scores = {}
+    for files in postings:
+        idf = math.log(1 + total / max(len(files), 1))
+        for filename in candidates:
+            if filename in files:
+                scores[filename] = scores.get(filename, 0.0) + idf * (1 + math.log(len(files[filename])))
+    ranked = sorted(candidates, key=lambda name: (-scores.get(name, 0.0), name))
+
+    words = search_term.split()
+    results = []
+    for filename in ranked[:max_results]:
+        line_hits = {}
+        for files in postings:
+            for line_number in files.get(filename, []):
+                line_hits[line_number] = line_hits.get(line_number, 0) + 1
+        best = sorted(line_hits, key=lambda n: (-line_hits[n], n))[:3]
+        try:
+            previews = read_lines(filename, best)
+        except OSError:
+            continue
+        if case_sensitive:
+            best = [n for n in best if all(word in previews.get(n, "") for word in words)]
+            if not best:
+                continue
+        results.append(f"**{filename}** (score {scores.get(filename, 0.0):.2f})")
+        for line_number in best:
+            results.append(f"- line {line_number}: `{previews.get(line_number, '').strip()[:120]}`")
+
+    if not results:
+        return f"No matches for **{search_term}** in {indexed_count} file(s)"
+    return f"### 🔎 Results for \"{search_term}\"\n\n" + "\n".join(results)
+
+def search_target(session):
+    """Whether the session's search covers a whole large file rather than the editor text."""
+    filename = session["current_file"]
+    return filename if filename in large_files and session["window"] is not None else None
+
+@contextmanager
+def search_buffer(session, content):
+    """Yield (buffer, version) to search: the editor text, or the large file mapped from disk."""
+    filename = search_target(session)
+    if filename is None:
+        yield content, hashlib.sha1(content.encode("utf-8")).hexdigest()
+        return
+    entry = large_files[filename]
+    with read_locked(entry["path"]):
+        if not os.path.getsize(entry["path"]):
+            yield b"", entry["mtime"]
+            return
+        with open(entry["path"], "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm, entry["mtime"]
+
+def search_cursor(session, hit):
+    """Hidden HTML telling custom_js() which editor range to select; lines are relative to the editor text."""
+    if hit is None:
+        return ""
+    window = session["window"] if search_target(session) else None
+    line = hit["line"] - 1 - (window["start"] if window else 0)
+    session["search"]["seq"] += 1
+    return (f'<span data-line="{line}" data-column="{hit["column"]}" data-length="{hit["length"]}" '
+            f'data-seq="{session["search"]["seq"]}"></span>')
+
+def run_search(content, search_term, case_sensitive, scope, mode, session):
+    """Search the current file (streaming results as they are found) or the whole workspace."""
+    if scope == "All files":
+        if mode == "Regex":
+            yield "Regex search covers the current file; the workspace index matches whole words", "", session
+        else:
+            yield search_all_files(search_term, case_sensitive), "", session
+        return
+    if not search_term:
+        yield "Please enter a search term", "", session
+        return
+
+    binary = search_target(session) is not None
+    try:
+        pattern = compile_search(search_term, mode, case_sensitive, binary)
+    except re.error as e:
+        yield f"❌ Invalid regex: {e}", "", session
+        return
+
+    session["search"] = {"term": search_term, "mode": mode, "case_sensitive": case_sensitive,
+                         "binary": binary, "hits": [], "cursor": -1, "total": None,
+                         "version": None, "seq": (session.get("search") or {}).get("seq", 0)}
+    state = session["search"]
+    with search_buffer(session, content) as (buffer, version):
+        state["version"] = version
+        for hits, total, done in scan_matches(buffer, pattern, params["search_max_hits"], params["stream_ui_interval"]):
+            state["hits"] = list(hits)
+            if done:
+                state["total"] = total
+            cursor = ""
+            # Select the first match as soon as it is found
+            if hits and state["cursor"] < 0:
+                state["cursor"] = 0
+                cursor = search_cursor(session, hits[0])
+            yield format_search_hits(search_term, mode, hits, total, done), cursor if cursor else gr.update(), session
+
+def navigate_search(content, session, direction):
+    """Step to the next or previous match without touching the text.
+
+    In large-file mode the window moves to the match's line through the
+    file's line-offset index."""
+    state = session.get("search")
+    if not state:
+        return gr.update(), gr.update(), "Run a search first", "", session
+    pattern = compile_search(state["term"], state["mode"], state["case_sensitive"], state["binary"])
+    with search_buffer(session, content) as (buffer, version):
+        if version != state["version"]:
+            # The text changed since the search: start over from the top
+            state.update(hits=[], cursor=-1, total=None, version=version)
+        hits = state["hits"]
+        target = state["cursor"] + direction
+        if direction > 0 and target >= len(hits):
+            hit = next_match(buffer, pattern, hits[-1] if hits else None)
+            if hit is not None:
+                hits.append(hit)
+            elif hits:
+                state["total"] = len(hits)
+                target = 0
+        elif target < 0:
+            # Wrapping backwards needs every match, which is only known after a full scan
+            target = len(hits) - 1 if state["total"] == len(hits) else 0
+    if not hits:
+        return gr.update(), gr.update(), f"No matches for `{state['term']}`", "", session
+
+    state["cursor"] = target
+    hit = hits[target]
+    editor, status = gr.update(), gr.update()
+    window = session["window"]
+    if search_target(session) and not window["start"] < hit["line"] <= window["end"]:
+        editor, status, session = move_window(session, hit["line"] - 1)
+    total = f"{state['total']:,}" if state["total"] is not None else "?"
+    position = f"Match {target + 1} of {total} · line {hit['line']}, col {hit['column'] + 1}"
+    return editor, status, position, search_cursor(session, hit), session
+
+def split_token_chunks(lines):
+    """Group lines into paragraph-aligned chunks whose boundaries depend only on local content.
+
+    Yields (text, lines) pairs; joining the texts reproduces the input exactly.
+    """
+    min_chars = params["token_chunk_chars"]
+    chunk = []
+    size = 0
+    previous = ""
+    cut = False
+    for line in lines:
+        if cut:
+            yield "\n".join(chunk) + "\n", chunk
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+        # Cut after a blank line, keyed on a hash of the paragraph's last line
+        # so an edit only moves nearby boundaries
+        if line:
+            cut = size >= 16 * min_chars
+        else:
+            cut = size >= 4 * min_chars or (size >= min_chars and zlib.crc32(previous.encode("utf-8")) & 0x3 == 0)
+        previous = line
+    if chunk:
+        yield "\n".join(chunk), chunk
+
+def count_chunk_tokens(chunk):
+    """Token count of one chunk, memoized by content hash."""
+    key = hashlib.sha1(chunk.encode("utf-8")).digest()
+    with token_lock:
+        if key in token_cache:
+            token_cache.move_to_end(key)
+            return token_cache[key]
+    count = len(encode(chunk, add_special_tokens=False)[0])
+    with token_lock:
+        token_cache[key] = count
+        while len(token_cache) > params["token_cache_size"]:
+            token_cache.popitem(last=False)
+    return count
+
+def count_tokens(content):
+    """Count tokens chunk by chunk; re-encodes only chunks not seen before."""
+    # Special tokens (BOS etc.) are added once per prompt, not per chunk
+    overhead = len(encode("")[0])
+    return overhead + sum(count_chunk_tokens(text) for text, _ in split_token_chunks(iter_text_lines(content)))
+
+def update_file_token_count(filename, content, mtime=None):
+    """Remember the token count of a file for the file dropdown."""
+    file_path = os.path.join(extension_dir, "files", filename)
+    try:
+        mtime = os.path.getmtime(file_path) if mtime is None else mtime
+        file_token_counts[filename] = (mtime, count_tokens(content))
+    except Exception:
+        file_token_counts.pop(filename, None)
+        return None
+    return file_token_counts[filename][1]
+
+def cached_file_token_count(filename):
+    """The file's token count if it was counted at its current mtime, else None."""
+    known = file_token_counts.get(filename)
+    file_path = os.path.join(extension_dir, "files", filename)
+    if known and known[0] == last_modified.get(file_path):
+        return known[1]
+    return None
+
+def schedule_file_token_count(filename, content):
+    """Count a file's tokens on a background thread, keeping the tokenizer off the open path."""
+    mtime = last_modified.get(os.path.join(extension_dir, "files", filename))
+    with token_count_state["lock"]:
+        if filename in token_count_state["pending"]:
+            return
+        token_count_state["pending"].add(filename)
+        if token_count_state["executor"] is None:
+            token_count_state["executor"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="text-manager-tokens")
+
+    def count():
+        try:
+            update_file_token_count(filename, content, mtime)
+        finally:
+            with token_count_state["lock"]:
+                token_count_state["pending"].discard(filename)
+
+    token_count_state["executor"].submit(count)
+
+def get_file_choices():
+    """File dropdown choices labelled with line and token counts where known."""
+    choices = []
+    filenames = get_file_list()
+    entries = file_list_cache["entries"] or {}
+    for filename in filenames:
+        mtime = entries.get(filename, (None,))[0]
+        label = [filename]
+        lines = file_list_cache["lines"].get(filename)
+        if lines and lines[0] == mtime:
+            label.append(f"{lines[1]} lines")
+        known = file_token_counts.get(filename)
+        if known and known[0] == mtime:
+            label.append(f"{known[1]} tok")
+        choices.append((" · ".join(label), filename))
+    return choices
+
+URL_RE = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+def iter_text_lines(content):
+    """Yield the lines of a string as content.split("\\n") would, without building the list."""
+    start = 0
+    while True:
+        end = content.find("\n", start)
+        if end == -1:
+            yield content[start:]
+            return
+        yield content[start:end]
+        start = end + 1
+
+def iter_file_lines(f):
+    """Yield the lines of a text stream with the same semantics as iter_text_lines."""
+    line = ""
+    for line in f:
+        yield line[:-1] if line.endswith("\n") else line
+    if line == "" or line.endswith("\n"):
+        yield ""
+
+def write_lines(lines, f):
+    """Write lines to a stream separated by newlines, like "\\n".join."""
+    first = True
+    for line in lines:
+        if not first:
+            f.write("\n")
+        f.write(line)
+        first = False
+
+# Line-level pipeline stages: each takes an iterator of lines and yields lines
+def stage_trim(lines):
+    for line in lines:
+        yield line.strip()
+
+def stage_count_tokens(lines):
+    total = 0
+    available = True
+    try:
+        total = len(encode("")[0])
+    except Exception:
+        available = False
+    for text, chunk in split_token_chunks(lines):
+        if available:
+            try:
+                total += count_chunk_tokens(text)
+            except Exception:
+                available = False
+        yield from chunk
+    yield ""
+    yield "---"
+    yield f"*Token count: {total}*" if available else "*Token counting not available*"
+
+def stage_count_words(lines):
+    word_count = char_count = line_count = 0
+    for line in lines:
+        word_count += len(line.split())
+        char_count += len(line) + 1
+        line_count += 1
+        yield line
+    yield ""
+    yield "---"
+    yield f"*Words: {word_count} | Characters: {max(char_count - 1, 0)} | Lines: {line_count}*"
+
+def stage_uppercase(lines):
+    for line in lines:
+        yield line.upper()
+
+def stage_lowercase(lines):
+    for line in lines:
+        yield line.lower()
+
+def stage_remove_empty(lines):
+    for line in lines:
+        if line.strip():
+            yield line
+
+def sort_key(numeric=False, key_field=0, separator=None):
+    """Build a sort key on the whole line or on one 1-based field."""
+    def key(line):
+        value = line
+        if key_field:
+            fields = line.split(separator)
+            value = fields[key_field - 1] if key_field <= len(fields) else ""
+        if numeric:
+            try:
+                number = float(value)
+            except ValueError:
+                return (1, 0.0, value)
+            # NaN compares false both ways, so it would leave runs unsorted
+            if math.isnan(number) or math.isinf(number):
+                return (1, 0.0, value)
+            return (0, number, "")
+        return value
+    return key
+
+def write_sort_run(lines, key, tmp_dir):
+    """Sort a batch of lines and spill it to a temporary run file."""
+    lines.sort(key=key)
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with open(fd, "w", encoding="utf-8", newline="\n") as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    return path
+
+def read_sort_run(path):
+    """Stream the lines of a run file back."""
+    with open(path, "r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            yield line[:-1]
+
+def merge_sort_runs(runs, key, tmp_dir):
+    """Merge runs down to at most sort_merge_fan_in files, then stream the final merge."""
+    fan_in = max(2, params["sort_merge_fan_in"])
+    while len(runs) > fan_in:
+        merged = []
+        for i in range(0, len(runs), fan_in):
+            group = runs[i:i + fan_in]
+            fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+            with open(fd, "w", encoding="utf-8", newline="\n") as f:
+                for line in heapq.merge(*(read_sort_run(run) for run in group), key=key):
+                    f.write(line)
+                    f.write("\n")
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+    return heapq.merge(*(read_sort_run(run) for run in runs), key=key)
+
+def external_sort(lines, unique=False, numeric=False, key_field=None, memory_budget=None, stats=None):
+    """Sort non-empty lines under a memory budget, spilling sorted runs to disk as needed."""
+    if key_field is None:
+        key_field = params["sort_key_field"]
+    memory_budget = memory_budget or params["sort_memory_budget"]
+    key = sort_key(numeric, key_field, params["sort_field_separator"])
+    if unique:
+        # Break key ties on the full line so duplicates end up adjacent
+        base_key = key
+        key = lambda line: (base_key(line), line)
+
+    with tempfile.TemporaryDirectory(prefix="tmp_sort_", dir=params["sort_tmp_dir"]) as tmp_dir:
+        runs = []
+        batch = []
+        size = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            batch.append(line)
+            # Rough per-line overhead of a Python str in a list
+            size += len(line) + 64
+            if size >= memory_budget:
+                runs.append(write_sort_run(batch, key, tmp_dir))
+                batch, size = [], 0
+
+        if runs:
+            if batch:
+                runs.append(write_sort_run(batch, key, tmp_dir))
+                batch = []
+            merged = merge_sort_runs(runs, key, tmp_dir)
+        else:
+            batch.sort(key=key)
+            merged = iter(batch)
+        if stats is not None:
+            stats["runs"] = len(runs)
+
+        previous = None
+        for line in merged:
+            if unique and line == previous:
+                continue
+            previous = line
+            yield line
+
+def stage_sort(lines, unique=False, numeric=False):
+    yield from external_sort(lines, unique=unique, numeric=numeric)
+
+def stage_reverse(lines):
+    yield from reversed(list(lines))
+
+def stage_extract_urls(lines):
+    found = False
+    for line in lines:
+        for url in URL_RE.findall(line):
+            if not found:
+                yield "# Extracted URLs:"
+                yield ""
+                found = True
+            yield url
+    if not found:
+        yield "No URLs found in the text."
+
+def stage_markdown_list(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield f"- {line}"
+
+SENTENCE_END_RE = re.compile(r'[.!?]+["\')\]]*\s+')
+
+def token_segments(lines, max_tokens):
+    """Yield (separator, text, tokens) per sentence, encoding each sentence once.
+
+    The separator is "\n\n" for the first sentence of a paragraph. Sentences
+    longer than max_tokens are split on token boundaries.
+    """
+    paragraph = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line)
+            continue
+        if paragraph:
+            yield from paragraph_segments("\n".join(paragraph), max_tokens)
+            paragraph = []
+    if paragraph:
+        yield from paragraph_segments("\n".join(paragraph), max_tokens)
+
+def paragraph_segments(text, max_tokens):
+    """Split one paragraph into sentence segments with their token counts.
+
+    The first segment's count includes the paragraph break that join_segments
+    puts in front of it."""
+    separator = "\n\n"
+    break_tokens = count_chunk_tokens(separator)
+    start = 0
+    for cut in [m.end() for m in SENTENCE_END_RE.finditer(text)] + [len(text)]:
+        if cut <= start:
+            continue
+        sentence = text[start:cut]
+        start = cut
+        tokens = count_chunk_tokens(sentence)
+        if tokens <= max_tokens:
+            yield separator, sentence, tokens + (break_tokens if separator else 0)
+        else:
+            # Decode growing prefixes and slice off the new characters: decoding a
+            # window on its own loses leading spaces and splits multi-byte characters
+            ids = encode(sentence, add_special_tokens=False)[0]
+            shown, last = "", 0
+            while last < len(ids):
+                extra = break_tokens if separator else 0
+                end = min(last + max(1, max_tokens - extra), len(ids))
+                decoded = decode(ids[:end])
+                # Back off so no window ends inside a multi-byte character
+                while end < len(ids) and end > last + 1 and decoded.endswith("\ufffd"):
+                    end -= 1
+                    decoded = decode(ids[:end])
+                yield separator, decoded[len(shown):], end - last + extra
+                shown, last = decoded, end
+                separator = ""
+        separator = ""
+
+def join_segments(segments):
+    """Text of a chunk, keeping paragraph breaks between its sentences."""
+    return "".join((separator if i else "") + text for i, (separator, text, _) in enumerate(segments)).rstrip()
+
+def chunk_by_tokens(lines, max_tokens=None, overlap=None):
+    """Group sentences into chunks of at most max_tokens, ending on a paragraph break where possible.
+
+    Yields (text, tokens). Each chunk after the first starts with up to
+    overlap tokens of whole sentences from the end of the previous one.
+    Chunks are planned from per-sentence counts, then each one is encoded
+    once as joined and trimmed by whole sentences if it came out over the limit.
+    """
+    max_tokens = max(1, int(max_tokens or params["chunk_max_tokens"]))
+    overlap = min(max(0, int(params["chunk_overlap"] if overlap is None else overlap)), max_tokens // 2)
+    chunk, total, carried = [], 0, 0
+
+    def fit(cut):
+        # Keep at least one segment that was not carried over, so chunking always advances
+        while True:
+            text = join_segments(chunk[:cut])
+            tokens = count_chunk_tokens(text)
+            if tokens <= max_tokens or cut <= carried + 1:
+                return cut, text, tokens
+            cut -= 1
+
+    def carry_over(cut, incoming):
+        # The rest of the chunk, led by up to overlap tokens from the end of what was emitted
+        tail, tail_tokens = [], 0
+        for s in reversed(chunk[:cut]):
+            if tail_tokens + s[2] > overlap:
+                break
+            tail.insert(0, s)
+            tail_tokens += s[2]
+        rest = chunk[cut:]
+        rest_tokens = sum(s[2] for s in rest)
+        if tail and rest_tokens + tail_tokens + incoming <= max_tokens:
+            return tail + rest, rest_tokens + tail_tokens, len(tail)
+        return rest, rest_tokens, 0
+
+    for segment in token_segments(lines, max_tokens):
+        while chunk and total + segment[2] > max_tokens:
+            # Cut at the last paragraph break that keeps the chunk at least half full
+            cut = len(chunk)
+            size = total
+            for k in range(len(chunk) - 1, carried, -1):
+                size -= chunk[k][2]
+                if chunk[k][0]:
+                    if size >= max_tokens // 2:
+                        cut = k
+                    break
+            cut, text, tokens = fit(cut)
+            yield text, tokens
+            chunk, total, carried = carry_over(cut, segment[2])
+        chunk.append(segment)
+        total += segment[2]
+    while len(chunk) > carried:
+        cut, text, tokens = fit(len(chunk))
+        yield text, tokens
+        if cut == len(chunk):
+            break
+        chunk, total, carried = carry_over(cut, 0)
+
+def stage_chunk_tokens(lines):
+    # Without a loaded model, pass the text through as stage_count_tokens does
+    try:
+        encode("")
+    except Exception:
+        yield from lines
+        yield ""
+        yield "---"
+        yield "*Token chunking not available*"
+        return
+    for number, (text, tokens) in enumerate(chunk_by_tokens(lines), 1):
+        if number > 1:
+            yield ""
+        yield f"--- Chunk {number} · {tokens} tokens ---"
+        yield from iter_text_lines(text)
+
+OPERATION_STAGES = {
+    "Trim Whitespace": stage_trim,
+    "Count Tokens": stage_count_tokens,
+    "Count Words": stage_count_words,
+    "Convert to Uppercase": stage_uppercase,
+    "Convert to Lowercase": stage_lowercase,
+    "Remove Empty Lines": stage_remove_empty,
+    "Sort Lines": stage_sort,
+    "Sort Lines (Unique)": partial(stage_sort, unique=True),
+    "Sort Lines (Numeric)": partial(stage_sort, numeric=True),
+    "Reverse Lines": stage_reverse,
+    "Extract URLs": stage_extract_urls,
+    "Format as Markdown List": stage_markdown_list,
+    "Chunk by Tokens": stage_chunk_tokens
+}
+
+def run_pipeline(lines, operations):
+    """Fuse a chain of operations into one lazy pass over the input lines."""
+    for operation in operations:
+        stage = OPERATION_STAGES.get(operation)
+        if stage is not None:
+            lines = stage(lines)
+    return lines
+
+@instrumented
+def process_text(content, operation):
+    """Process text with various operations."""
+    if operation not in OPERATION_STAGES:
+        return content
+    return "\n".join(run_pipeline(iter_text_lines(content), [operation]))
+
+def apply_operations(content, operations):
+    """Apply a chain of operations in a single pass."""
+    return "\n".join(run_pipeline(iter_text_lines(content), operations))
+
+def process_stream(input_path, output_path, operations):
+    """Run an operation chain from one file to another, holding roughly a line at a time."""
+    with open(input_path, "r", encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+        write_lines(run_pipeline(iter_file_lines(src), operations), dst)
+
+def sort_file(filename, unique=False, numeric=False, key_field=0):
+    """Sort a file of any size into exports/ using the external merge sort."""
+    if not filename:
+        return "No file selected"
+    try:
+        file_path = os.path.join(extension_dir, "files", filename)
+        export_dir = os.path.join(extension_dir, "exports")
+        os.makedirs(export_dir, exist_ok=True)
+        base_name = os.path.splitext(filename)[0]
+        export_path = os.path.join(export_dir, f"{base_name}_sorted_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+
+        stats = {}
+        started = time.time()
+        with open(file_path, "r", encoding="utf-8") as src, open(export_path, "w", encoding="utf-8") as dst:
+            sorted_lines = external_sort(iter_file_lines(src), unique=unique, numeric=numeric,
+                                         key_field=int(key_field or 0), stats=stats)
+            write_lines(sorted_lines, dst)
+        return f"✅ Sorted {filename} into {export_path} ({stats.get('runs', 0)} spilled run(s), {time.time() - started:.1f}s)"
+    except Exception as e:
+        return f"❌ Sort failed: {e}"
+
+def chunk_file(filename, max_tokens=None, overlap=None):
+    """Split a file into token-bounded chunks, streaming them to a JSONL file in exports/."""
+    if not filename:
+        yield "No file selected"
+        return
+    try:
+        file_path = os.path.join(extension_dir, "files", filename)
+        export_dir = os.path.join(extension_dir, "exports")
+        os.makedirs(export_dir, exist_ok=True)
+        base_name = os.path.splitext(filename)[0]
+        export_path = os.path.join(export_dir, f"{base_name}_chunks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        try:
+            encode("")
+        except Exception as e:
+            yield f"❌ Token chunking not available: {e}"
+            return
+
+        count = 0
+        started = time.time()
+        with open(file_path, "r", encoding="utf-8") as src, open(export_path, "w", encoding="utf-8") as dst:
+            for text, tokens in chunk_by_tokens(iter_file_lines(src), max_tokens, overlap):
+                count += 1
+                dst.write(json.dumps({"chunk": count, "tokens": tokens, "text": text}, ensure_ascii=False) + "\n")
+                if count % 50 == 0:
+                    yield f"⏳ {count} chunks written..."
+        yield f"✅ Split {filename} into {count} chunk(s) in {export_path} ({time.time() - started:.1f}s)"
+    except Exception as e:
+        yield f"❌ Chunking failed: {e}"
+
+def batch_worker(file_path, operations, output_path, settings=None):
+    """Process one file; streams straight to the output path when one is given.
+
+    Pool workers start from a fresh import, so they take the caller's settings instead of the defaults."""
+    if settings is not None:
+        params.update(settings)
+    if output_path is not None:
+        process_stream(file_path, output_path, operations)
+        return None
+    with open(file_path, "r", encoding="utf-8") as f:
+        return "\n".join(run_pipeline(iter_file_lines(f), operations))
+
+def batch_process(pattern, operations, destination):
+    """Run an operation chain over every matching file, streaming progress."""
+    if not operations:
+        yield "Please select at least one operation"
+        return
+    filenames = [name for name in get_file_list() if fnmatch.fnmatch(name, pattern or "*")]
+    if not filenames:
+        yield f"No files match `{pattern}`"
+        return
+
+    in_place = destination != "exports/"
+    output_dir = None
+    if not in_place:
+        output_dir = os.path.join(extension_dir, "exports", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Model-backed operations stay in this process; the rest fan out over all cores.
+    # Workers are spawned rather than forked so they never inherit the server's threads and locks
+    settings = None
+    if MODEL_OPERATIONS.intersection(operations):
+        executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        executor = ProcessPoolExecutor(max_workers=params["batch_workers"], mp_context=multiprocessing.get_context("spawn"))
+        settings = dict(params)
+
+    done, failed = 0, []
+    started = time.time()
+    with executor:
+        futures = {}
+        for filename in filenames:
+            file_path = os.path.join(extension_dir, "files", filename)
+            output_path = None if in_place else os.path.join(output_dir, filename)
+            futures[executor.submit(batch_worker, file_path, list(operations), output_path, settings)] = filename
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                result = future.result()
+                if in_place:
+                    status, _ = save_text(result, filename)
+                    if status.startswith("❌"):
+                        raise IOError(status)
+            except Exception as e:
+                failed.append(f"- {filename}: {e}")
+            done += 1
+            yield f"⏳ {done}/{len(filenames)} files processed (last: {filename})"
+
+    target = "in place" if in_place else f"to `{output_dir}`"
+    summary = f"✅ Processed {done - len(failed)}/{len(filenames)} files {target} in {time.time() - started:.1f}s"
+    if failed:
+        summary += "\n\n❌ Failed:\n" + "\n".join(failed)
+    yield summary
+
+def shingle_hashes(lines, size):
+    """CRC32 of every run of size consecutive lowercase words, across line breaks."""
+    window = deque(maxlen=size)
+    emitted = False
+    for line in lines:
+        for term in tokenize_terms(line):
+            window.append(term)
+            if len(window) == size:
+                emitted = True
+                yield zlib.crc32(" ".join(window).encode("utf-8"))
+    # Texts shorter than one shingle hash as a whole
+    if window and not emitted:
+        yield zlib.crc32(" ".join(window).encode("utf-8"))
+
+def minhash_coefficients(num_perm):
+    """Seeded multiply-shift hash functions, shared by the NumPy and pure-Python paths."""
+    coefficients = minhash_state["coefficients"].get(num_perm)
+    if coefficients is None:
+        rng = random.Random(MINHASH_SEED)
+        coefficients = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+        minhash_state["coefficients"][num_perm] = coefficients
+    return coefficients
+
+def minhash_signature(hashes, num_perm=None):
+    """MinHash signature of a stream of shingle hashes, or None if there were none.
+
+    Each hash function is ((a * x + b) mod 2**64) >> 32; hashes are consumed in
+    blocks, vectorized over all functions at once when NumPy is available."""
+    num_perm = num_perm or params["dedup_num_perm"]
+    coefficients = minhash_coefficients(num_perm)
+    hashes = iter(hashes)
+    empty = True
+    if np is not None:
+        arrays = minhash_state["coefficients"].get(("numpy", num_perm))
+        if arrays is None:
+            arrays = tuple(np.array(column, dtype=np.uint64)[:, None] for column in zip(*coefficients))
+            minhash_state["coefficients"][("numpy", num_perm)] = arrays
+        a, b = arrays
+        signature = np.full(len(coefficients), 1 << 32, dtype=np.uint64)
+        while True:
+            block = np.fromiter(islice(hashes, MINHASH_BLOCK), dtype=np.uint64)
+            if not block.size:
+                break
+            empty = False
+            np.minimum(signature, ((a * block + b) >> np.uint64(32)).min(axis=1), out=signature)
+        return None if empty else signature
+
+    mask = (1 << 64) - 1
+    signature = [1 << 32] * len(coefficients)
+    while True:
+        block = list(islice(hashes, MINHASH_BLOCK))
+        if not block:
+            break
+        empty = False
+        for i, (a, b) in enumerate(coefficients):
+            lowest = min(((a * x + b) & mask) >> 32 for x in block)
+            if lowest < signature[i]:
+                signature[i] = lowest
+    return None if empty else signature
+
+def signature_similarity(first, second):
+    """Estimated Jaccard similarity: the fraction of matching MinHash values."""
+    if np is not None:
+        return float(np.count_nonzero(first == second)) / len(first)
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+def band_keys(signature, bands):
+    """LSH bucket keys: one per band of rows, tagged with the band number."""
+    rows = len(signature) // bands
+    if np is not None:
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+    return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(bands)]
+
+def iter_paragraphs(lines):
+    """Yield (first line number, lines) for each blank-line separated paragraph."""
+    paragraph, start = [], 0
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            if not paragraph:
+                start = number
+            paragraph.append(line)
+        elif paragraph:
+            yield start, paragraph
+            paragraph = []
+    if paragraph:
+        yield start, paragraph
+
+def file_signatures(filename, unit):
+    """MinHash units of a file as (line, preview, signature), cached until its mtime or size changes."""
+    file_path = os.path.join(extension_dir, "files", filename)
+    stat = os.stat(file_path)
+    with minhash_state["lock"]:
+        entry = minhash_state["files"].get(filename)
+        if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            entry = {"mtime": stat.st_mtime, "size": stat.st_size}
+            minhash_state["files"][filename] = entry
+        if unit in entry:
+            return entry[unit]
+
+    size = params["dedup_shingle_size"]
+    units = []
+    with read_locked(file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            if unit == "Files":
+                signature = minhash_signature(shingle_hashes(iter_file_lines(f), size))
+                if signature is not None:
+                    units.append((1, f"{stat.st_size:,} bytes", signature))
+            else:
+                for start, lines in iter_paragraphs(iter_file_lines(f)):
+                    if sum(len(tokenize_terms(line)) for line in lines) < params["dedup_min_words"]:
+                        continue
+                    preview = " ".join(line.strip() for line in lines)[:80].replace("`", "'")
+                    units.append((start, preview, minhash_signature(shingle_hashes(lines, size))))
+    entry[unit] = units
+    return units
+
+def cluster_near_duplicates(units, threshold, bands=None):
+    """Group units whose estimated similarity reaches threshold; returns [(members, scores)].
+
+    Units sharing an LSH bucket are verified against the bucket's first member
+    only, so identical boilerplate in many places stays linear."""
+    bands = bands or params["dedup_bands"]
+    buckets = {}
+    for index, (_, _, _, signature) in enumerate(units):
+        for key in band_keys(signature, bands):
+            buckets.setdefault(key, []).append(index)
 
-def search_text(content, search_term, case_sensitive):
-    """Search and highlight text."""
-    if not search_term:
-        return content
-    
-    flags = 0 if case_sensitive else re.IGNORECASE
-    pattern = re.escape(search_term)
-    highlighted = re.sub(f"({pattern})", r"**\1**", content, flags=flags)
-    
-    # Count occurrences
-    matches = len(re.findall(pattern, content, flags=flags))
-    return highlighted + f"\n\n---\n*Found {matches} occurrence(s)*"
+    parent = list(range(len(units)))
 
-def process_text(content, operation):
-    """Process text with various operations."""
-    if operation == "Trim Whitespace":
-        return "\n".join(line.strip() for line in content.split("\n"))
-    elif operation == "Count Tokens":
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    scores = {}
+    for members in buckets.values():
+        first = members[0]
+        for other in members[1:]:
+            if (first, other) in scores:
+                continue
+            score = signature_similarity(units[first][3], units[other][3])
+            if score >= threshold:
+                scores[(first, other)] = score
+                parent[find(other)] = find(first)
+
+    clusters = {}
+    for index in range(len(units)):
+        clusters.setdefault(find(index), []).append(index)
+    edges = {}
+    for (first, other), score in scores.items():
+        edges.setdefault(find(first), []).append(score)
+    result = [(members, edges[root]) for root, members in clusters.items() if len(members) > 1]
+    result.sort(key=lambda cluster: (-len(cluster[0]), -max(cluster[1])))
+    return result
+
+def find_near_duplicates(pattern, unit="Files", threshold=None):
+    """Report clusters of near-identical files or paragraphs across the workspace."""
+    threshold = float(threshold or params["dedup_threshold"])
+    filenames = [name for name in get_file_list() if fnmatch.fnmatch(name, pattern or "*")]
+    if not filenames:
+        yield f"No files match `{pattern}`"
+        return
+
+    # Signatures made with other settings cannot be compared
+    settings = (params["dedup_shingle_size"], params["dedup_num_perm"], params["dedup_min_words"])
+    with minhash_state["lock"]:
+        if minhash_state["settings"] != settings:
+            minhash_state["files"].clear()
+            minhash_state["settings"] = settings
+        for filename in set(minhash_state["files"]) - set(get_file_list()):
+            del minhash_state["files"][filename]
+
+    started = time.time()
+    shown = time.monotonic()
+    units, failed = [], []
+    for done, filename in enumerate(filenames, 1):
         try:
-            tokens = encode(content)[0]
-            token_count = len(tokens)
-            return content + f"\n\n---\n*Token count: {token_count}*"
-        except:
-            return content + "\n\n---\n*Token counting not available*"
-    elif operation == "Count Words":
-        word_count = len(content.split())
-        char_count = len(content)
-        line_count = len(content.split("\n"))
-        return content + f"\n\n---\n*Words: {word_count} | Characters: {char_count} | Lines: {line_count}*"
-    elif operation == "Convert to Uppercase":
-        return content.upper()
-    elif operation == "Convert to Lowercase":
-        return content.lower()
-    elif operation == "Remove Empty Lines":
-        return "\n".join(line for line in content.split("\n") if line.strip())
-    elif operation == "Sort Lines":
-        lines = [line for line in content.split("\n") if line.strip()]
-        return "\n".join(sorted(lines))
-    elif operation == "Reverse Lines":
-        lines = content.split("\n")
-        return "\n".join(reversed(lines))
-    elif operation == "Extract URLs":
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, content)
-        if urls:
-            return "# Extracted URLs:\n\n" + "\n".join(urls)
-        else:
-            return "No URLs found in the text."
-    elif operation == "Format as Markdown List":
-        lines = [line.strip() for line in content.split("\n") if line.strip()]
-        return "\n".join(f"- {line}" for line in lines)
-    return content
+            units.extend((filename,) + item for item in file_signatures(filename, unit))
+        except (OSError, UnicodeDecodeError) as e:
+            failed.append(f"- {filename}: {e}")
+        if time.monotonic() - shown >= params["stream_ui_interval"]:
+            shown = time.monotonic()
+            yield f"⏳ Hashed {done}/{len(filenames)} files ({len(units)} {unit.lower()})..."
+
+    clusters = cluster_near_duplicates(units, threshold)
+    engine = "NumPy" if np is not None else "pure Python"
+    lines = [f"### 🧬 {len(clusters)} near-duplicate cluster(s) among {len(units)} {unit.lower()} "
+             f"(similarity ≥ {threshold:.2f}, {time.time() - started:.1f}s, {engine})"]
+    for number, (members, scores) in enumerate(clusters[:params["dedup_max_clusters"]], 1):
+        lines.append(f"\n**Cluster {number}** · {len(members)} {unit.lower()} · similarity {min(scores):.2f}–{max(scores):.2f}")
+        for index in members:
+            filename, line, preview, _ = units[index]
+            lines.append(f"- {filename}" if unit == "Files" else f"- {filename}, line {line}: `{preview}`")
+    if len(clusters) > params["dedup_max_clusters"]:
+        lines.append(f"\n*{len(clusters) - params['dedup_max_clusters']} more cluster(s) not shown*")
+    if failed:
+        lines.append("\n❌ Skipped:\n" + "\n".join(failed))
+    yield "\n".join(lines)
+
+EXPORT_FORMATS = ["Text (.txt)", "Markdown (.md)", "JSON (.json)", "JSON Lines (.jsonl)"]
+EXPORT_EXTENSIONS = {"Text (.txt)": ".txt", "Markdown (.md)": ".md", "JSON (.json)": ".json", "JSON Lines (.jsonl)": ".jsonl"}
+EXPORT_COMPRESSIONS = {"None": ("", open), "gzip (.gz)": (".gz", gzip.open), "bzip2 (.bz2)": (".bz2", bz2.open), "xz (.xz)": (".xz", lzma.open)}
+ARCHIVE_FORMATS = ["zip", "tar.gz"]
+EXPORT_SLICE = 1 << 20
+
+def write_json_export(content, filename, f):
+    """Write the JSON export incrementally, byte-for-byte as json.dump(..., indent=2) would."""
+    f.write("{\n")
+    f.write(f'  "filename": {json.dumps(filename, ensure_ascii=False)},\n')
+    f.write('  "content": "')
+    for start in range(0, len(content), EXPORT_SLICE):
+        f.write(json.dumps(content[start:start + EXPORT_SLICE], ensure_ascii=False)[1:-1])
+    f.write('",\n')
+    f.write(f'  "exported_at": {json.dumps(datetime.now().isoformat())},\n')
+    f.write('  "lines": [')
+    separator = "\n    "
+    for line in iter_text_lines(content):
+        f.write(separator)
+        f.write(json.dumps(line, ensure_ascii=False))
+        separator = ",\n    "
+    f.write("\n  ]\n}")
 
-def export_text(content, format_type, filename):
+def write_jsonl_export(content, f):
+    """One JSON object per line of text."""
+    for number, line in enumerate(iter_text_lines(content), 1):
+        f.write(json.dumps({"line": number, "text": line}, ensure_ascii=False))
+        f.write("\n")
+
+@instrumented
+def export_text(content, format_type, filename, compression="None"):
     """Export text in various formats."""
     try:
         export_dir = os.path.join(extension_dir, "exports")
@@ -190,60 +2804,326 @@ def export_text(content, format_type, filename):
         
         base_name = os.path.splitext(filename)[0] if filename else "export"
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if format_type not in EXPORT_EXTENSIONS:
+            return f"❌ Export failed: unknown format {format_type}"
+        suffix, opener = EXPORT_COMPRESSIONS.get(compression or "None", EXPORT_COMPRESSIONS["None"])
+        export_path = os.path.join(export_dir, f"{base_name}_{timestamp}{EXPORT_EXTENSIONS[format_type]}{suffix}")
         
-        if format_type == "Text (.txt)":
-            export_path = os.path.join(export_dir, f"{base_name}_{timestamp}.txt")
-            with open(export_path, "w", encoding="utf-8") as f:
-                f.write(content)
-        elif format_type == "Markdown (.md)":
-            export_path = os.path.join(export_dir, f"{base_name}_{timestamp}.md")
-            with open(export_path, "w", encoding="utf-8") as f:
-                f.write(content)
-        elif format_type == "JSON (.json)":
-            export_path = os.path.join(export_dir, f"{base_name}_{timestamp}.json")
-            data = {
-                "filename": filename,
-                "content": content,
-                "exported_at": datetime.now().isoformat(),
-                "lines": content.split("\n")
-            }
-            with open(export_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+        # Every format is written as a stream, so compression wraps them all the same way
+        with opener(export_path, "wt", encoding="utf-8") as f:
+            if format_type == "JSON (.json)":
+                write_json_export(content, filename, f)
+            elif format_type == "JSON Lines (.jsonl)":
+                write_jsonl_export(content, f)
+            else:
+                for start in range(0, len(content), EXPORT_SLICE):
+                    f.write(content[start:start + EXPORT_SLICE])
         
         return f"✅ Exported to: {export_path}"
     except Exception as e:
         return f"❌ Export failed: {e}"
 
+def write_archive(filenames, archive_path, archive_format, progress):
+    """Package files from files/ into a zip or tar.gz, updating progress as each file is added."""
+    partial_path = archive_path + ".part"
+    try:
+        if archive_format == "zip":
+            archive = zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED)
+            add = archive.write
+        else:
+            archive = tarfile.open(partial_path, "w:gz")
+            add = lambda path, arcname: archive.add(path, arcname=arcname, recursive=False)
+        with archive:
+            for filename in filenames:
+                file_path = os.path.join(extension_dir, "files", filename)
+                with read_locked(file_path):
+                    add(file_path, filename)
+                    progress["bytes"] += os.path.getsize(file_path)
+                progress["done"] += 1
+                progress["current"] = filename
+        os.replace(partial_path, archive_path)
+    except Exception as e:
+        progress["error"] = e
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def bulk_export(filenames, archive_format="zip"):
+    """Archive the selected files on a worker thread, streaming progress."""
+    filenames = [name for name in (filenames or []) if name in get_file_list()]
+    if not filenames:
+        yield "Please select at least one file"
+        return
+    export_dir = os.path.join(extension_dir, "exports")
+    os.makedirs(export_dir, exist_ok=True)
+    extension = ".zip" if archive_format == "zip" else ".tar.gz"
+    archive_path = os.path.join(export_dir, f"files_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}")
+
+    progress = {"done": 0, "bytes": 0, "current": None, "error": None}
+    started = time.time()
+    worker = threading.Thread(target=write_archive, args=(filenames, archive_path, archive_format, progress),
+                              name="text-manager-export", daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(0.5)
+        if progress["current"]:
+            yield f"⏳ {progress['done']}/{len(filenames)} files archived ({progress['bytes'] / 1048576:.1f} MB, last: {progress['current']})"
+    if progress["error"] is not None:
+        yield f"❌ Export failed: {progress['error']}"
+        return
+    yield f"✅ Exported {len(filenames)} file(s) to: {archive_path} ({time.time() - started:.1f}s)"
+
+def scan_files_dir():
+    """Stat every text file in files/ with a single scandir pass."""
+    files_dir = os.path.join(extension_dir, "files")
+    entries = {}
+    try:
+        with os.scandir(files_dir) as it:
+            for entry in it:
+                if entry.name.endswith(('.txt', '.md')) and entry.is_file():
+                    stat = entry.stat()
+                    entries[entry.name] = (stat.st_mtime, stat.st_size)
+    except OSError:
+        pass
+    return entries
+
 def get_file_list():
     """Get list of available files."""
-    files_dir = os.path.join(extension_dir, "files")
-    if os.path.exists(files_dir):
-        return [f for f in os.listdir(files_dir) if f.endswith(('.txt', '.md'))]
-    return []
+    # While the watcher runs it keeps the cache current; otherwise rescan only
+    # when the directory's mtime shows an entry was added, removed or replaced
+    if file_list_cache["entries"] is None or not watcher_running():
+        try:
+            dir_mtime = os.stat(os.path.join(extension_dir, "files")).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if file_list_cache["entries"] is None or dir_mtime is None or dir_mtime != file_list_cache["dir_mtime"]:
+            file_list_cache["entries"] = scan_files_dir()
+            file_list_cache["dir_mtime"] = dir_mtime
+    return sorted(file_list_cache["entries"])
+
+def record_line_count(filename, content, mtime):
+    """Remember a file's line count for the listing."""
+    file_list_cache["lines"][filename] = (mtime, content.count("\n") + 1)
+
+def load_file_listing():
+    """Restore line counts saved by the last run; stale ones are ignored by mtime."""
+    listing_path = os.path.join(extension_dir, "file_listing.json")
+    try:
+        with open(listing_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == 1:
+            file_list_cache["lines"].update({name: tuple(value) for name, value in data["lines"].items()})
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+def persist_file_listing():
+    """Save the line counts of files that still exist for the next start."""
+    if not extension_dir or file_list_cache["entries"] is None:
+        return
+    entries = file_list_cache["entries"]
+    lines = {name: list(value) for name, value in list(file_list_cache["lines"].items()) if name in entries}
+    try:
+        atomic_write(os.path.join(extension_dir, "file_listing.json"), json.dumps({"version": 1, "lines": lines}))
+    except OSError as e:
+        print(f"Text Manager Pro: could not persist file listing: {e}")
+
+def update_file_list_entry(filename):
+    """Refresh one cached listing entry after the extension itself touched the file."""
+    entries = file_list_cache["entries"]
+    if entries is None:
+        return
+    try:
+        stat = os.stat(os.path.join(extension_dir, "files", filename))
+    except OSError:
+        if entries.pop(filename, None) is not None:
+            record_change("deleted", filename)
+        return
+    if filename not in entries:
+        record_change("created", filename)
+    entries[filename] = (stat.st_mtime, stat.st_size)
+
+def record_change(kind, filename):
+    """Queue a change event for open editors to pick up."""
+    watcher_state["seq"] += 1
+    watcher_state["events"].append((watcher_state["seq"], kind, filename))
+
+def apply_disk_changes(snapshot):
+    """Bring caches and the search index in line with a fresh directory snapshot."""
+    previous = file_list_cache["entries"] or {}
+    for filename in previous.keys() - snapshot.keys():
+        file_path = os.path.join(extension_dir, "files", filename)
+        file_contents.pop(file_path, None)
+        last_modified.pop(file_path, None)
+        large_files.pop(filename, None)
+        unindex_file(filename)
+        record_change("deleted", filename)
+
+    for filename, (mtime, size) in snapshot.items():
+        if previous.get(filename) == (mtime, size):
+            continue
+        file_path = os.path.join(extension_dir, "files", filename)
+        if filename not in previous:
+            record_change("created", filename)
+        # Our own saves already refreshed the caches
+        if last_modified.get(file_path) == mtime:
+            continue
+        if file_path in file_contents:
+            load_file_content(file_path)
+        if filename in large_files:
+            with read_locked(file_path):
+                build_line_index(file_path, large_files[filename])
+        entry = indexed_files.get(filename)
+        if entry is None or entry["mtime"] != mtime:
+            index_file(filename)
+        if filename in previous:
+            record_change("modified", filename)
+
+    file_list_cache["entries"] = snapshot
+    persist_search_index()
+
+def watch_loop():
+    """Poll files/ for outside changes until stopped."""
+    stop = watcher_state["stop"]
+    while not stop.wait(params["refresh_interval"]):
+        try:
+            apply_disk_changes(scan_files_dir())
+        except Exception as e:
+            print(f"Text Manager Pro: file watcher error: {e}")
+
+def watcher_running():
+    """Whether the background watcher thread is alive."""
+    thread = watcher_state["thread"]
+    return thread is not None and thread.is_alive()
+
+def set_auto_refresh(enabled):
+    """Start or stop the background file watcher."""
+    params["auto_refresh"] = bool(enabled)
+    if enabled and not watcher_running():
+        file_list_cache["entries"] = scan_files_dir()
+        watcher_state["stop"] = threading.Event()
+        watcher_state["thread"] = threading.Thread(target=watch_loop, name="text-manager-watcher", daemon=True)
+        watcher_state["thread"].start()
+        return "👀 Watching files/ for outside changes"
+    if not enabled and watcher_running():
+        watcher_state["stop"].set()
+    return "Auto-refresh off"
+
+def poll_changes(session):
+    """Push outside changes to this browser session on each timer tick."""
+    events = [e for e in list(watcher_state["events"]) if e[0] > session["seen_seq"]]
+    if not events:
+        return gr.update(), with_autosave_error(gr.update(), session), gr.update(), session
+    session["seen_seq"] = events[-1][0]
+
+    editor, status, dropdown = gr.update(), gr.update(), gr.update()
+    if any(kind != "modified" for _, kind, _ in events):
+        dropdown = gr.update(choices=get_file_choices())
+    filename = session["current_file"]
+    if not filename or not any(kind == "modified" and name == filename for _, kind, name in events):
+        return editor, with_autosave_error(status, session), dropdown, session
+
+    file_path = os.path.join(extension_dir, "files", filename)
+    if session["version"] == last_modified.get(file_path):
+        return editor, with_autosave_error(status, session), dropdown, session
+    if session["dirty"]:
+        status = f"⚠️ {filename} changed on disk; you have unsaved edits"
+    elif filename in large_files and session["window"] is not None:
+        editor, status, window = read_window(filename, session["window"]["start"])
+        session.update(displayed_text=editor, window=window, version=window["mtime"])
+        show_in_editor(session, editor)
+    elif file_path in file_contents:
+        editor = file_contents[file_path]
+        session.update(displayed_text=editor, version=last_modified.get(file_path))
+        show_in_editor(session, editor)
+        status = f"🔄 Reloaded {filename} (changed on disk)"
+    return editor, with_autosave_error(status, session), dropdown, session
+
+def show_in_editor(session, content):
+    """Record text the server just put into the editor."""
+    session["editor_text"] = content
+    session["edit_version"] += 1
+
+def editor_tag(session):
+    """Which text the editor holds: the file and, in large-file mode, the window's first line."""
+    window = session["window"]
+    return f"{session['current_file'] or ''}:{window['start'] if window else ''}"
+
+def with_editor_tag(fn):
+    """Wrap a handler that ends with the session so it also returns the editor tag for the browser."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        result = fn(*args, **kwargs)
+        return (*result, editor_tag(result[-1]))
+    return wrapper
+
+def with_file_pickers(fn, index):
+    """Wrap a handler whose result[index] updates the file dropdown so the other file pickers follow it."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        result = fn(*args, **kwargs)
+        changed = isinstance(result[index], dict) and "choices" in result[index]
+        picker = gr.update(choices=get_file_list()) if changed else gr.update()
+        return (*result, picker, picker, picker)
+    return wrapper
+
+def sync_editor(content, session, tag=None):
+    """Take the editor text sent after a pause in typing; bumps the version stamp if it changed.
+
+    Text tagged with another file or window was typed before the editor moved on, so it is dropped."""
+    if tag is not None and tag != editor_tag(session):
+        return session
+    if content != session["editor_text"]:
+        session["editor_text"] = content
+        session["edit_version"] += 1
+    session["dirty"] = content != session["displayed_text"]
+    # A large-file window is only saved by hand: a save that changes its length rewrites the whole file
+    if session["dirty"] and session["auto_save"] and session["current_file"] and session["window"] is None:
+        queue_autosave(session["current_file"], content, session)
+    return session
+
+def set_auto_save(enabled, session):
+    """Turn auto-save on or off for this browser session only."""
+    session["auto_save"] = bool(enabled)
+    return session
+
+def sync_and_report(content, session, tag=None):
+    """Sync handler: also surfaces an auto-save that failed in the background."""
+    session = sync_editor(content, session, tag)
+    return with_autosave_error(gr.update(), session), session
+
+def refresh_tab(content, session, tab, tag=None):
+    """Copy the editor text into a secondary tab when it is opened, only if it is out of date."""
+    sync_editor(content, session, tag)
+    if session["tab_versions"].get(tab) == session["edit_version"]:
+        return gr.update(), session
+    session["tab_versions"][tab] = session["edit_version"]
+    return session["editor_text"], session
 
 def create_new_file(filename):
     """Create a new file."""
     if not filename:
-        return "Please enter a filename", get_file_list()
+        return "Please enter a filename", gr.update(choices=get_file_choices())
     
     if not filename.endswith(('.txt', '.md')):
         filename += '.txt'
     
     file_path = os.path.join(extension_dir, "files", filename)
     if os.path.exists(file_path):
-        return f"File {filename} already exists", get_file_list()
+        return f"File {filename} already exists", gr.update(choices=get_file_choices())
     
     try:
+        new_content = f"# {filename}\n\nNew file created on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         with open(file_path, "w", encoding="utf-8") as f:
-            f.write(f"# {filename}\n\nNew file created on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        return f"✅ Created: {filename}", get_file_list()
+            f.write(new_content)
+        index_file(filename, new_content)
+        update_file_list_entry(filename)
+        return f"✅ Created: {filename}", gr.update(choices=get_file_choices())
     except Exception as e:
-        return f"❌ Error: {e}", get_file_list()
+        return f"❌ Error: {e}", gr.update(choices=get_file_choices())
 
 def delete_file(filename):
     """Delete a file (moves to trash folder)."""
     if not filename:
-        return "No file selected", get_file_list()
+        return "No file selected", gr.update(choices=get_file_choices())
     
     try:
         file_path = os.path.join(extension_dir, "files", filename)
@@ -253,76 +3133,755 @@ def delete_file(filename):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         trash_path = os.path.join(trash_dir, f"{filename}.{timestamp}")
         
-        os.rename(file_path, trash_path)
-        return f"🗑️ Moved {filename} to trash", get_file_list()
+        if use_sqlite():
+            # The trash row and the removal commit together, or neither happens
+            with write_locked(file_path), db_transaction() as conn:
+                with open(file_path, "rb") as f:
+                    conn.execute("INSERT INTO trash (document, deleted_at, content) VALUES (?, ?, ?)",
+                                 (filename, timestamp, zlib.compress(f.read(), 6)))
+                conn.execute("DELETE FROM documents WHERE name = ?", (filename,))
+                os.remove(file_path)
+        else:
+            os.rename(file_path, trash_path)
+        unindex_file(filename)
+        persist_search_index()
+        update_file_list_entry(filename)
+        return f"🗑️ Moved {filename} to trash", gr.update(choices=get_file_choices())
     except Exception as e:
-        return f"❌ Error: {e}", get_file_list()
+        return f"❌ Error: {e}", gr.update(choices=get_file_choices())
+
+def line_hash(line):
+    """Short whitespace-insensitive hash of a line, used for bookmark anchors."""
+    return hashlib.sha1(line.strip().encode("utf-8")).hexdigest()[:12]
+
+def make_anchor(lines, index):
+    """Anchor a 0-based line by its own hash and the hashes of its neighbours."""
+    return {
+        "hash": line_hash(lines[index]) if index < len(lines) else "",
+        "before": line_hash(lines[index - 1]) if 0 < index <= len(lines) else "",
+        "after": line_hash(lines[index + 1]) if index + 1 < len(lines) else ""
+    }
+
+def nth_line(content, line_number):
+    """Return a 1-based line without splitting the whole text."""
+    start = 0
+    for _ in range(line_number - 1):
+        start = content.find("\n", start) + 1
+        if start == 0:
+            return ""
+    end = content.find("\n", start)
+    return content[start:] if end == -1 else content[start:end]
 
-def add_bookmark(content, line_number, bookmark_name):
+def ensure_bookmarks():
+    """Load bookmarks the first time they are needed."""
+    if not bookmark_journal["loaded"]:
+        with bookmarks_lock:
+            if not bookmark_journal["loaded"]:
+                load_bookmarks()
+
+def apply_bookmark_op(op):
+    """Apply one journal operation to the in-memory bookmarks; replaying it again is harmless."""
+    if op["op"] == "add":
+        # A crash between writing the snapshot and truncating the journal
+        # replays adds the snapshot already holds
+        items = bookmarks.setdefault(op["file"], [])
+        if not any(bookmark.get("id") == op["bookmark"]["id"] for bookmark in items):
+            items.append(op["bookmark"])
+    elif op["op"] == "move":
+        for bookmark in bookmarks.get(op["file"], []):
+            if bookmark.get("id") == op["id"]:
+                bookmark.update(line=op["line"], preview=op["preview"], anchor=op["anchor"])
+
+def db_write_bookmark_ops(ops):
+    """Apply bookmark operations to the bookmarks table in one transaction."""
+    with db_transaction() as conn:
+        for op in ops:
+            if op["op"] == "add":
+                b = op["bookmark"]
+                conn.execute(
+                    "INSERT OR REPLACE INTO bookmarks (id, document, name, line, preview, created, anchor) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (b["id"], op["file"], b["name"], b["line"], b.get("preview"), b.get("created"), json.dumps(b.get("anchor")))
+                )
+            elif op["op"] == "move":
+                conn.execute(
+                    "UPDATE bookmarks SET line = ?, preview = ?, anchor = ? WHERE id = ?",
+                    (op["line"], op["preview"], json.dumps(op["anchor"]), op["id"])
+                )
+
+def append_bookmark_journal(ops):
+    """Append operations to bookmarks.jsonl, compacting once the journal grows long."""
+    if use_sqlite():
+        db_write_bookmark_ops(ops)
+        return
+    journal_path = os.path.join(extension_dir, "bookmarks.jsonl")
+    with open(journal_path, "a", encoding="utf-8") as f:
+        for op in ops:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+    bookmark_journal["entries"] += len(ops)
+    if bookmark_journal["entries"] >= params["bookmark_compact_after"]:
+        compact_bookmarks()
+
+def compact_bookmarks():
+    """Fold the journal into the bookmarks.json snapshot and truncate it."""
+    with bookmarks_lock:
+        bookmarks_path = os.path.join(extension_dir, "bookmarks.json")
+        atomic_write(bookmarks_path, json.dumps(bookmarks, indent=2, ensure_ascii=False))
+        open(os.path.join(extension_dir, "bookmarks.jsonl"), "w").close()
+        bookmark_journal["entries"] = 0
+
+def load_bookmarks(backend=None):
+    """Load the bookmarks snapshot and replay the journal written since."""
+    with bookmarks_lock:
+        bookmarks.clear()
+        bookmark_journal["loaded"] = True
+        if use_sqlite(backend):
+            for bookmark_id, document, name, line, preview, created, anchor in db().execute(
+                    "SELECT id, document, name, line, preview, created, anchor FROM bookmarks ORDER BY rowid"):
+                bookmarks.setdefault(document, []).append({
+                    "id": bookmark_id, "name": name, "line": line, "preview": preview,
+                    "created": created, "anchor": json.loads(anchor) if anchor else None
+                })
+            return
+        bookmarks_path = os.path.join(extension_dir, "bookmarks.json")
+        if os.path.exists(bookmarks_path):
+            with open(bookmarks_path, "r", encoding="utf-8") as f:
+                bookmarks.update(json.load(f))
+        journal_path = os.path.join(extension_dir, "bookmarks.jsonl")
+        entries = 0
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        apply_bookmark_op(json.loads(line))
+                        entries += 1
+                    except (ValueError, KeyError):
+                        # A torn final write from a crash; everything before it is intact
+                        break
+        bookmark_journal["entries"] = entries
+
+        # Bookmarks from before the journal have no id or anchor yet
+        upgraded = False
+        for items in bookmarks.values():
+            for bookmark in items:
+                if "id" not in bookmark:
+                    bookmark["id"] = os.urandom(6).hex()
+                    bookmark.setdefault("anchor", {"hash": line_hash(bookmark.get("preview", "")), "before": "", "after": ""})
+                    upgraded = True
+        if upgraded or entries >= params["bookmark_compact_after"]:
+            compact_bookmarks()
+
+def relocate_line(line, old_lines, new_lines, opcodes, anchor):
+    """Map a 0-based line through a diff, falling back to its anchor if the line itself changed."""
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 <= line < i2 or (i1 == i2 == line):
+            if tag == "equal":
+                return j1 + (line - i1)
+            break
+    else:
+        return max(len(new_lines) - 1, 0)
+
+    # The line was edited or removed: look for its hash near where it went
+    radius = params["bookmark_search_radius"]
+    best, best_score = None, 0
+    for j in range(max(0, j1 - radius), min(len(new_lines), j2 + radius)):
+        if line_hash(new_lines[j]) != anchor.get("hash"):
+            continue
+        score = 1 + (j > 0 and line_hash(new_lines[j - 1]) == anchor.get("before")) \
+                  + (j + 1 < len(new_lines) and line_hash(new_lines[j + 1]) == anchor.get("after"))
+        if score > best_score or (score == best_score and abs(j - j1) < abs(best - j1)):
+            best, best_score = j, score
+    if best is not None:
+        return best
+    return min(j1, max(len(new_lines) - 1, 0))
+
+def remap_bookmarks(filename, old_content, new_content):
+    """Move a file's bookmarks to follow their lines after a save."""
+    ensure_bookmarks()
+    with bookmarks_lock:
+        items = bookmarks.get(filename)
+        if not items or old_content is None or old_content == new_content:
+            return
+        old_lines = old_content.split("\n")
+        new_lines = new_content.split("\n")
+        opcodes = diff_opcodes(old_lines, new_lines)
+        ops = []
+        for bookmark in items:
+            anchor = bookmark.get("anchor") or make_anchor(old_lines, bookmark["line"] - 1)
+            new_index = relocate_line(bookmark["line"] - 1, old_lines, new_lines, opcodes, anchor)
+            new_anchor = make_anchor(new_lines, new_index)
+            if new_index + 1 == bookmark["line"] and new_anchor == anchor:
+                continue
+            op = {
+                "op": "move",
+                "file": filename,
+                "id": bookmark["id"],
+                "line": new_index + 1,
+                "preview": new_lines[new_index] if new_index < len(new_lines) else "",
+                "anchor": new_anchor
+            }
+            apply_bookmark_op(op)
+            ops.append(op)
+        if ops:
+            append_bookmark_journal(ops)
+
+def list_bookmarks(filename):
+    """Markdown list of a file's bookmarks."""
+    ensure_bookmarks()
+    items = bookmarks.get(filename) or []
+    if not items:
+        return ""
+    return "\n".join(f"- **{b['name']}** (line {b['line']}): `{b.get('preview', '').strip()[:60]}`" for b in items)
+
+def add_bookmark(content, line_number, bookmark_name, filename):
     """Add a bookmark to the current file."""
-    global bookmarks, current_file
-    
-    if not current_file:
+    if not filename:
         return "No file loaded"
     
     if not bookmark_name:
         bookmark_name = f"Bookmark at line {line_number}"
     
-    if current_file not in bookmarks:
-        bookmarks[current_file] = []
-    
-    bookmarks[current_file].append({
+    preview = nth_line(content, line_number)
+    before = nth_line(content, line_number - 1) if line_number > 1 else None
+    after = nth_line(content, line_number + 1)
+    bookmark = {
+        "id": os.urandom(6).hex(),
         "name": bookmark_name,
         "line": line_number,
-        "preview": content.split('\n')[line_number-1] if line_number <= len(content.split('\n')) else "",
-        "created": datetime.now().isoformat()
-    })
+        "preview": preview,
+        "created": datetime.now().isoformat(),
+        "anchor": {
+            "hash": line_hash(preview),
+            "before": line_hash(before) if before is not None else "",
+            "after": line_hash(after) if content.count("\n", 0, len(content)) >= line_number else ""
+        }
+    }
     
-    # Save bookmarks
-    bookmarks_path = os.path.join(extension_dir, "bookmarks.json")
-    with open(bookmarks_path, "w") as f:
-        json.dump(bookmarks, f, indent=2)
+    # One journal line per bookmark, however many already exist
+    ensure_bookmarks()
+    with bookmarks_lock:
+        op = {"op": "add", "file": filename, "bookmark": bookmark}
+        apply_bookmark_op(op)
+        append_bookmark_journal([op])
     
-    return f"✅ Bookmark added: {bookmark_name}"
+    return f"✅ Bookmark added: {bookmark_name}\n\n" + list_bookmarks(filename)
 
-def get_diff(old_content, new_content):
-    """Get diff between two versions of content."""
+def intern_lines(a_lines, b_lines):
+    """Map lines to small integers so comparisons are int compares."""
+    table = {}
+    a = [table.setdefault(line, len(table)) for line in a_lines]
+    b = [table.setdefault(line, len(table)) for line in b_lines]
+    return a, b
+
+def myers_matches(a, b, max_cost, deadline):
+    """Matching index pairs of a shortest edit script (Myers O(ND)), or None over budget."""
+    n, m = len(a), len(b)
+    if not n or not m:
+        return []
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_cost) + 1):
+        if d % 32 == 0 and time.monotonic() > deadline:
+            return None
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return backtrack_matches(trace, n, m)
+    return None
+
+def backtrack_matches(trace, x, y):
+    """Walk the saved Myers frontiers back from the end to recover the snakes."""
+    matches = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((x, y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((x, y))
+    matches.reverse()
+    return matches
+
+def patience_matches(a, b, a_lo, a_hi, b_lo, b_hi, deadline):
+    """Anchor on lines unique to both sides, then diff the gaps between anchors."""
+    # Extend the region edges first; cheap and keeps anchors meaningful
+    matches = []
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        matches.append((a_lo, b_lo))
+        a_lo += 1
+        b_lo += 1
+    tail = []
+    while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+        tail.append((a_hi, b_hi))
+
+    counts = {}
+    for i in range(a_lo, a_hi):
+        entry = counts.setdefault(a[i], [0, 0, i])
+        entry[0] += 1
+    for j in range(b_lo, b_hi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry.append(j)
+    pairs = sorted((entry[2], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[1] == 1)
+
+    # Longest increasing subsequence of b positions (patience sorting)
+    piles, tops, links = [], [], {}
+    for pair in pairs:
+        pos = bisect_left(tops, pair[1])
+        links[pair] = piles[pos - 1] if pos else None
+        if pos == len(piles):
+            piles.append(pair)
+            tops.append(pair[1])
+        else:
+            piles[pos] = pair
+            tops[pos] = pair[1]
+    anchors = []
+    pair = piles[-1] if piles else None
+    while pair is not None:
+        anchors.append(pair)
+        pair = links[pair]
+    anchors.reverse()
+
+    if not anchors:
+        gap = myers_matches(a[a_lo:a_hi], b[b_lo:b_hi], params["diff_max_cost"], deadline)
+        # Out of budget: report the region as replaced
+        matches.extend((a_lo + i, b_lo + j) for i, j in gap or [])
+    else:
+        i, j = a_lo, b_lo
+        for anchor_i, anchor_j in anchors:
+            matches.extend(patience_matches(a, b, i, anchor_i, j, anchor_j, deadline))
+            matches.append((anchor_i, anchor_j))
+            i, j = anchor_i + 1, anchor_j + 1
+        matches.extend(patience_matches(a, b, i, a_hi, j, b_hi, deadline))
+    matches.extend(reversed(tail))
+    return matches
+
+def diff_opcodes(a_lines, b_lines, timeout=None):
+    """difflib-style opcodes turning a_lines into b_lines.
+
+    Trims the common prefix and suffix, runs Myers on the rest and falls back
+    to patience anchoring when the edit distance or time budget is exceeded.
+    """
+    a, b = intern_lines(a_lines, b_lines)
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+
+    deadline = time.monotonic() + (params["diff_timeout"] if timeout is None else timeout)
+    middle_a, middle_b = a[prefix:n - suffix], b[prefix:m - suffix]
+    middle = myers_matches(middle_a, middle_b, params["diff_max_cost"], deadline)
+    if middle is None:
+        middle = patience_matches(middle_a, middle_b, 0, len(middle_a), 0, len(middle_b), deadline)
+
+    matches = [(i, i) for i in range(prefix)]
+    matches.extend((prefix + i, prefix + j) for i, j in middle)
+    matches.extend((n - suffix + i, m - suffix + i) for i in range(suffix))
+
+    opcodes = []
+    i = j = 0
+    for x, y in matches + [(n, m)]:
+        if x > i or y > j:
+            tag = "replace" if x > i and y > j else ("delete" if x > i else "insert")
+            opcodes.append((tag, i, x, j, y))
+        if x < n or y < m:
+            if opcodes and opcodes[-1][0] == "equal" and opcodes[-1][2] == x:
+                tag, i1, _, j1, _ = opcodes.pop()
+                opcodes.append(("equal", i1, x + 1, j1, y + 1))
+            else:
+                opcodes.append(("equal", x, x + 1, y, y + 1))
+        i, j = x + 1, y + 1
+    return opcodes
+
+def diff_hunks(old_content, new_content, context=None):
+    """Structured unified-diff hunks between two texts."""
+    context = params["diff_context"] if context is None else context
     old_lines = old_content.splitlines(keepends=True)
     new_lines = new_content.splitlines(keepends=True)
-    
-    diff = difflib.unified_diff(old_lines, new_lines, fromfile='Previous', tofile='Current', lineterm='')
-    diff_text = ''.join(diff)
-    
-    if diff_text:
-        return f"```diff\n{diff_text}\n```"
-    else:
+    opcodes = diff_opcodes(old_lines, new_lines)
+
+    # Group changes that are within 2 * context lines of each other
+    groups, group = [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            if group and i2 - i1 > 2 * context:
+                group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+                groups.append(group)
+                group = []
+                i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+            if group or i2 - i1 <= context:
+                group.append((tag, i1, i2, j1, j2))
+            else:
+                group.append((tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2))
+        else:
+            group.append((tag, i1, i2, j1, j2))
+    if group and any(op[0] != "equal" for op in group):
+        if group[-1][0] == "equal":
+            tag, i1, i2, j1, j2 = group[-1]
+            group[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+        groups.append(group)
+
+    hunks = []
+    for group in groups:
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend((" ", line) for line in old_lines[i1:i2])
+                continue
+            lines.extend(("-", line) for line in old_lines[i1:i2])
+            lines.extend(("+", line) for line in new_lines[j1:j2])
+        hunks.append({
+            "old_start": group[0][1] + 1,
+            "old_count": group[-1][2] - group[0][1],
+            "new_start": group[0][3] + 1,
+            "new_count": group[-1][4] - group[0][3],
+            "lines": lines
+        })
+    return hunks
+
+def render_hunks(hunks, fromfile="Previous", tofile="Current"):
+    """Render hunks as a unified diff in a markdown code block."""
+    if not hunks:
         return "No changes detected"
+    added = sum(1 for hunk in hunks for tag, _ in hunk["lines"] if tag == "+")
+    removed = sum(1 for hunk in hunks for tag, _ in hunk["lines"] if tag == "-")
+    shown = hunks[:params["diff_max_hunks_displayed"]]
+    out = [f"--- {fromfile}", f"+++ {tofile}"]
+    for hunk in shown:
+        # Unified diff numbers an empty range by the line before it
+        old_start = hunk["old_start"] - (hunk["old_count"] == 0)
+        new_start = hunk["new_start"] - (hunk["new_count"] == 0)
+        out.append(f"@@ -{old_start},{hunk['old_count']} +{new_start},{hunk['new_count']} @@")
+        out.extend(tag + line.rstrip("\r\n") for tag, line in hunk["lines"])
+    summary = f"*{len(hunks)} hunk(s), +{added} / -{removed} lines*"
+    if len(shown) < len(hunks):
+        summary += f" — showing the first {len(shown)}"
+    return summary + "\n\n```diff\n" + "\n".join(out) + "\n```"
+
+@instrumented
+def get_diff(old_content, new_content):
+    """Get diff between two versions of content."""
+    return render_hunks(diff_hunks(old_content, new_content))
+
+BUILTIN_TEMPLATES = {
+    "Translation": "Translate the following text to [TARGET_LANGUAGE]:\n\n{content}",
+    "Summary": "Please summarize the following text in 3-5 bullet points:\n\n{content}",
+    "Rewrite": "Please rewrite the following text to be more clear and concise:\n\n{content}",
+    "Explain": "Please explain the following text in simple terms:\n\n{content}",
+    "Questions": "Generate 5 questions about the following text:\n\n{content}",
+    "Keywords": "Extract the main keywords and concepts from this text:\n\n{content}",
+    "Sentiment": "Analyze the sentiment and tone of this text:\n\n{content}",
+    "Fact Check": "Please fact-check and verify the claims in this text:\n\n{content}",
+    "SD Prompt": "Positive prompt: {content}\n\nNegative prompt: [ADD_NEGATIVE_TERMS]",
+    "Custom": "{content}"
+}
+
+BUDGET_MODES = ["Off", "Truncate", "Middle elide"]
+ELISION_MARKER = "\n\n[...]\n\n"
+
+template_registry = {"files": {}, "templates": None, "lock": threading.Lock()}
+
+def compile_template(text):
+    """Split a template around its {content} placeholders; without one the content goes at the end."""
+    parts = tuple(text.split("{content}"))
+    if len(parts) == 1:
+        parts = (text.rstrip() + "\n\n", "")
+    return parts
+
+def parse_template_file(text):
+    """Compile the "## Name" sections of a template file."""
+    templates = OrderedDict()
+    name, body = None, []
+    for line in text.split("\n") + ["## "]:
+        if line.startswith("## "):
+            if name and "\n".join(body).strip():
+                templates[name] = compile_template("\n".join(body).strip("\n"))
+            name, body = line[3:].strip(), []
+        elif name:
+            body.append(line)
+    return templates
+
+def load_templates():
+    """Compiled templates: built-ins overridden by template files, re-parsed only when a file changes."""
+    with template_registry["lock"]:
+        changed = template_registry["templates"] is None
+        seen = set()
+        for filename in params["template_files"]:
+            file_path = os.path.join(extension_dir, "files", filename)
+            seen.add(filename)
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except OSError:
+                changed |= template_registry["files"].pop(filename, None) is not None
+                continue
+            cached = template_registry["files"].get(filename)
+            if cached is None or cached[0] != mtime:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    template_registry["files"][filename] = (mtime, parse_template_file(f.read()))
+                changed = True
+        for filename in set(template_registry["files"]) - seen:
+            del template_registry["files"][filename]
+            changed = True
+        
+        if changed:
+            templates = OrderedDict((name, compile_template(text)) for name, text in BUILTIN_TEMPLATES.items())
+            for filename in params["template_files"]:
+                if filename in template_registry["files"]:
+                    templates.update(template_registry["files"][filename][1])
+            template_registry["templates"] = templates
+        return template_registry["templates"]
+
+def get_template_names():
+    """Names for the template dropdown."""
+    return list(load_templates())
+
+def prompt_token_budget():
+    """Tokens available for a prompt: the model context minus room for the reply."""
+    if params["template_token_budget"]:
+        return params["template_token_budget"]
+    return shared.settings["truncation_length"] - shared.settings["max_new_tokens"]
+
+def exact_tokens(text):
+    """Exact token count of a piece of text, without special tokens."""
+    return len(encode(text, add_special_tokens=False)[0]) if text else 0
+
+def cut_points(content):
+    """Offsets at which content may be cut: every run of whitespace, plus both ends."""
+    return [0] + [m.end() for m in re.finditer(r'\s+', content)] + [len(content)]
+
+def longest_prefix(content, cuts, budget):
+    """Binary search for the longest prefix ending at a cut point that fits the budget."""
+    lo, hi = 0, len(cuts) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if exact_tokens(content[:cuts[mid]]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return content[:cuts[lo]]
 
-def format_for_prompt(content, template_type):
+def longest_suffix(content, cuts, budget):
+    """Binary search for the longest suffix starting at a cut point that fits the budget."""
+    lo, hi = 0, len(cuts) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if exact_tokens(content[cuts[mid]:]) <= budget:
+            hi = mid
+        else:
+            lo = mid + 1
+    return content[cuts[lo]:]
+
+def fit_to_budget(content, budget, mode):
+    """Shorten content to at most budget tokens by truncating its end or eliding its middle."""
+    if budget <= 0:
+        return ""
+    if count_tokens(content) - len(encode("")[0]) <= budget:
+        return content
+    cuts = cut_points(content)
+    if mode == "Middle elide":
+        room = budget - exact_tokens(ELISION_MARKER)
+        if room > 1:
+            head = longest_prefix(content, cuts, room // 2)
+            tail_cuts = [cut for cut in cuts if cut >= len(head)]
+            tail = longest_suffix(content, tail_cuts, room - exact_tokens(head))
+            return head.rstrip() + ELISION_MARKER + tail.lstrip()
+    return longest_prefix(content, cuts, budget).rstrip()
+
+def render_template(content, template_type, budget_mode="Off"):
+    """Render a template once, fitting the content to the model's context if asked; returns (prompt, status)."""
+    parts = load_templates().get(template_type, ("", ""))
+    if budget_mode in ("Truncate", "Middle elide"):
+        try:
+            budget = prompt_token_budget()
+            fixed = exact_tokens("".join(parts))
+            per_copy = (budget - fixed) // max(len(parts) - 1, 1)
+            fitted = fit_to_budget(content, per_copy, budget_mode)
+            prompt = fitted.join(parts)
+            status = f"{count_tokens(prompt)} / {budget} tokens"
+        except Exception as e:
+            # Without a tokenizer the prompt is still usable, just not fitted
+            return content.join(parts), f"❌ Token budget unavailable: {e}"
+        if fitted != content:
+            status += f" · {budget_mode.lower()}d to fit"
+        return prompt, status
+    return content.join(parts), ""
+
+def format_for_prompt(content, template_type, budget_mode="Off"):
     """Format text for various prompt templates."""
-    templates = {
-        "Translation": f"Translate the following text to [TARGET_LANGUAGE]:\n\n{content}",
-        "Summary": f"Please summarize the following text in 3-5 bullet points:\n\n{content}",
-        "Rewrite": f"Please rewrite the following text to be more clear and concise:\n\n{content}",
-        "Explain": f"Please explain the following text in simple terms:\n\n{content}",
-        "Questions": f"Generate 5 questions about the following text:\n\n{content}",
-        "Keywords": f"Extract the main keywords and concepts from this text:\n\n{content}",
-        "Sentiment": f"Analyze the sentiment and tone of this text:\n\n{content}",
-        "Fact Check": f"Please fact-check and verify the claims in this text:\n\n{content}",
-        "SD Prompt": f"Positive prompt: {content}\n\nNegative prompt: [ADD_NEGATIVE_TERMS]",
-        "Custom": content
-    }
-    
-    return templates.get(template_type, content)
+    return render_template(content, template_type, budget_mode)[0]
+
+def generation_state():
+    """Generation settings for generate_reply: the webui defaults plus the values last set in its UI."""
+    state = dict(shared.settings)
+    state.update(getattr(shared, "persistent_interface_state", None) or {})
+    return state
+
+def stream_generation(prompt, generator=None):
+    """Yield (reply so far, new text) as the model generates; generator defaults to generate_reply."""
+    generator = generator or generate_reply
+    previous = ""
+    for reply in generator(prompt, generation_state(), stopping_strings=[], is_chat=False):
+        if len(reply) > len(previous):
+            yield reply, reply[len(previous):]
+            previous = reply
+
+def target_path(target_file):
+    """Resolve an output file name inside files/, adding .txt like new files do."""
+    filename = os.path.basename(target_file.strip())
+    if not filename.strip(". "):
+        raise ValueError(f"Invalid file name: {target_file!r}")
+    if not filename.endswith(('.txt', '.md')):
+        filename += '.txt'
+    return filename, os.path.join(extension_dir, "files", filename)
+
+def refresh_appended_file(filename, start_offset):
+    """Bring caches, the index and open editors up to date after appending to a file."""
+    file_path = os.path.join(extension_dir, "files", filename)
+    existed = filename in (file_list_cache["entries"] or {})
+    if filename in large_files:
+        with read_locked(file_path):
+            build_line_index(file_path, large_files[filename], start_offset)
+        last_modified[file_path] = os.path.getmtime(file_path)
+        index_file(filename)
+    else:
+        content = load_file_content(file_path)
+        index_file(filename, content)
+        update_file_token_count(filename, content)
+    update_file_list_entry(filename)
+    if existed:
+        record_change("modified", filename)
+
+def generate_into(prompt, target_file=None, header=None, generator=None, progress=None):
+    """Stream one generation, appending it to target_file through a buffered writer.
+
+    Yields the reply so far at most every stream_ui_interval seconds, and
+    once more when generation ends. progress["reply"], if given, holds the
+    latest text after every step, so callers can show it if generation fails.
+    """
+    out = None
+    target_file = (target_file or "").strip()
+    if target_file:
+        filename, file_path = target_path(target_file)
+        start_offset = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        out = open(file_path, "a", encoding="utf-8", buffering=params["generation_buffer"])
+    reply = ""
+    try:
+        if out is not None:
+            header = header or f"Generated {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            out.write(("\n\n" if start_offset else "") + f"## {header}\n\n")
+        last_shown = time.monotonic()
+        for reply, new_text in stream_generation(prompt, generator):
+            if progress is not None:
+                progress["reply"] = reply
+            if out is not None:
+                out.write(new_text)
+            if time.monotonic() - last_shown >= params["stream_ui_interval"]:
+                last_shown = time.monotonic()
+                yield reply
+    finally:
+        if out is not None:
+            out.close()
+            refresh_appended_file(filename, start_offset)
+    yield reply
+
+def send_to_chat(content, target_file=None, generator=None):
+    """Send a formatted prompt to the loaded model, streaming the reply and optionally appending it to a file."""
+    if not content or not content.strip():
+        yield "", "Nothing to send"
+        return
+    started = time.time()
+    target_file = (target_file or "").strip()
+    progress = {"reply": ""}
+    reply = ""
+    try:
+        for reply in generate_into(content, target_file, generator=generator, progress=progress):
+            yield reply, f"⏳ Generating... {len(reply)} characters"
+    except Exception as e:
+        # Throttled yields can lag behind what was already appended to the file
+        yield progress["reply"], f"❌ Generation failed: {e}"
+        return
+    where = f" and appended to {target_path(target_file)[0]}" if target_file else ""
+    yield reply, f"✅ Generated {len(reply)} characters in {time.time() - started:.1f}s{where}"
+
+def generation_queue(source):
+    """Yield (label, text) work items from matching files, or from chunk files in exports/ for *.jsonl."""
+    if source.endswith(".jsonl"):
+        export_dir = os.path.join(extension_dir, "exports")
+        for name in sorted(fnmatch.filter(os.listdir(export_dir), source)):
+            with open(os.path.join(export_dir, name), "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        yield f"{name} · chunk {row['chunk']}", row["text"]
+    else:
+        for filename in fnmatch.filter(get_file_list(), source or "*"):
+            with open(os.path.join(extension_dir, "files", filename), "r", encoding="utf-8") as f:
+                yield filename, f.read()
 
-def send_to_chat(content):
-    """Send content to the chat interface."""
-    # This function would integrate with the chat interface
-    # For now, we'll return a formatted version
-    return f"📤 Ready to send to chat:\n\n{content[:200]}..."
+def batch_generate(template_type, budget_mode, source, target_file, generator=None):
+    """Run one template over many files or chunks, one generation at a time, appending each reply to target_file."""
+    if not source:
+        yield "", "Enter a file pattern or a chunks .jsonl name"
+        return
+    target_file = (target_file or "").strip()
+    if not target_file:
+        target_file = f"generated_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    try:
+        filename = target_path(target_file)[0]
+    except ValueError as e:
+        yield "", f"❌ {e}"
+        return
+    done, failed = 0, []
+    reply = ""
+    started = time.time()
+    try:
+        for label, text in generation_queue(source):
+            prompt = render_template(text, template_type, budget_mode)[0]
+            try:
+                for reply in generate_into(prompt, filename, header=label, generator=generator):
+                    yield reply, f"⏳ {done} done · generating for {label}"
+            except Exception as e:
+                failed.append(f"- {label}: {e}")
+            done += 1
+    except Exception as e:
+        yield reply, f"❌ Batch failed after {done} item(s): {e}"
+        return
+    summary = f"✅ Generated {done - len(failed)}/{done} item(s) into {filename} in {time.time() - started:.1f}s"
+    if failed:
+        summary += "\n\n❌ Failed:\n" + "\n".join(failed)
+    yield reply, summary
 
 def ui():
     """Create the UI components."""
+    started = time.perf_counter()
+    session_state = gr.State(new_session())
+    file_list = get_file_list()
+    
     with gr.Tabs():
         # Main Editor Tab
         with gr.Tab("Editor"):
@@ -330,9 +3889,9 @@ def ui():
                 with gr.Column(scale=3):
                     # File selector
                     file_dropdown = gr.Dropdown(
-                        choices=get_file_list(),
+                        choices=get_file_choices(),
                         label="📁 Select File",
-                        value=params["default_files"][0] if get_file_list() else None
+                        value=params["default_files"][0] if file_list else None
                     )
                     
                     # Main text editor
@@ -351,6 +3910,18 @@ def ui():
                         save_as_btn = gr.Button("💾 Save As")
                     
                     save_status = gr.Markdown()
+                    
+                    # Clicked by the editor's debounce timer in custom_js()
+                    sync_btn = gr.Button("sync", elem_id="text-manager-sync", elem_classes="text-manager-hidden")
+                    # Sent back with every sync so text typed into an earlier window or file is dropped
+                    editor_tag_box = gr.Textbox(value=editor_tag(session_state.value), elem_classes="text-manager-hidden")
+                    
+                    # Large-file navigation
+                    with gr.Row():
+                        prev_page_btn = gr.Button("◀ Prev Page", size="sm")
+                        next_page_btn = gr.Button("Next Page ▶", size="sm")
+                        jump_line = gr.Number(label="Go to line:", value=1, precision=0)
+                        jump_btn = gr.Button("↪ Jump", size="sm")
                 
                 with gr.Column(scale=1):
                     # File management
@@ -360,13 +3931,24 @@ def ui():
                         create_btn = gr.Button("➕ Create", size="sm")
                         delete_btn = gr.Button("🗑️ Delete", size="sm", variant="stop")
                     
+                    auto_refresh = gr.Checkbox(label="Auto-refresh from disk", value=params["auto_refresh"])
+                    auto_save = gr.Checkbox(label="Auto-save", value=params["auto_save"])
                     file_status = gr.Markdown()
                     
                     # Search
                     gr.Markdown("### 🔍 Search")
                     search_input = gr.Textbox(label="Search term:", placeholder="Enter text to search")
+                    search_scope = gr.Radio(["Current file", "All files"], label="Search in:", value="Current file")
+                    search_mode = gr.Radio(SEARCH_MODES, label="Match:", value="Literal")
                     case_sensitive = gr.Checkbox(label="Case sensitive", value=False)
-                    search_btn = gr.Button("🔍 Search")
+                    with gr.Row():
+                        search_btn = gr.Button("🔍 Search")
+                        prev_match_btn = gr.Button("⬆ Prev", size="sm")
+                        next_match_btn = gr.Button("⬇ Next", size="sm")
+                    search_position = gr.Markdown()
+                    # Read by custom_js() to select the current match in the editor
+                    search_cursor_html = gr.HTML(elem_id="text-manager-search-cursor", elem_classes="text-manager-hidden")
+                    search_results = gr.Markdown()
                     
                     # Bookmarks
                     gr.Markdown("### 📌 Bookmarks")
@@ -376,7 +3958,7 @@ def ui():
                     bookmark_status = gr.Markdown()
         
         # Text Processing Tab
-        with gr.Tab("Processing"):
+        with gr.Tab("Processing") as processing_tab:
             with gr.Row():
                 with gr.Column():
                     process_input = gr.Textbox(
@@ -386,23 +3968,19 @@ def ui():
                     )
                     
                     operation_dropdown = gr.Dropdown(
-                        choices=[
-                            "Trim Whitespace",
-                            "Count Tokens",
-                            "Count Words",
-                            "Convert to Uppercase",
-                            "Convert to Lowercase",
-                            "Remove Empty Lines",
-                            "Sort Lines",
-                            "Reverse Lines",
-                            "Extract URLs",
-                            "Format as Markdown List"
-                        ],
+                        choices=OPERATIONS,
                         label="Select Operation",
                         value="Count Words"
                     )
                     
                     process_btn = gr.Button("⚡ Process Text", variant="primary")
+                    
+                    chain_operations = gr.Dropdown(
+                        choices=OPERATIONS,
+                        label="Operation chain (applied in order in a single pass)",
+                        multiselect=True
+                    )
+                    chain_btn = gr.Button("⛓️ Run Chain")
                 
                 with gr.Column():
                     process_output = gr.Textbox(
@@ -413,15 +3991,70 @@ def ui():
                     # Export options
                     gr.Markdown("### 📤 Export Options")
                     export_format = gr.Dropdown(
-                        choices=["Text (.txt)", "Markdown (.md)", "JSON (.json)"],
+                        choices=EXPORT_FORMATS,
                         label="Export Format",
                         value="Text (.txt)"
                     )
+                    export_compression = gr.Dropdown(
+                        choices=list(EXPORT_COMPRESSIONS),
+                        label="Compression",
+                        value="None"
+                    )
                     export_btn = gr.Button("📥 Export")
+                    
+                    # Several files from files/ in one archive
+                    bulk_export_files = gr.Dropdown(
+                        choices=file_list,
+                        label="Files to archive",
+                        multiselect=True
+                    )
+                    bulk_export_format = gr.Radio(ARCHIVE_FORMATS, label="Archive format", value="zip")
+                    bulk_export_btn = gr.Button("🗜️ Export Selected Files")
                     export_status = gr.Markdown()
+            
+            # Batch processing
+            gr.Markdown("### 🗂️ Batch Processing")
+            with gr.Row():
+                batch_pattern = gr.Textbox(label="Files (glob):", value="*.txt", scale=1)
+                batch_destination = gr.Radio(
+                    ["exports/", "In place (with backup)"],
+                    label="Write results to:",
+                    value="exports/",
+                    scale=1
+                )
+            batch_btn = gr.Button("🚀 Run Batch", variant="primary")
+            batch_status = gr.Markdown()
+            
+            # External sort for files larger than memory
+            gr.Markdown("### 🧮 Sort Large File")
+            with gr.Row():
+                sort_source = gr.Dropdown(choices=file_list, label="File to sort", scale=2)
+                sort_key_field = gr.Number(label="Key field (0 = whole line)", value=params["sort_key_field"], precision=0)
+                sort_unique = gr.Checkbox(label="Unique (drop duplicates)", value=False)
+                sort_numeric = gr.Checkbox(label="Numeric", value=False)
+            sort_btn = gr.Button("🧮 Sort into exports/")
+            sort_status = gr.Markdown()
+            
+            # Token-bounded chunks for long-context summarization or translation
+            gr.Markdown("### ✂️ Chunk by Tokens")
+            with gr.Row():
+                chunk_source = gr.Dropdown(choices=file_list, label="File to chunk", scale=2)
+                chunk_max_tokens = gr.Number(label="Max tokens per chunk", value=params["chunk_max_tokens"], precision=0)
+                chunk_overlap = gr.Number(label="Overlap (tokens)", value=params["chunk_overlap"], precision=0)
+            chunk_btn = gr.Button("✂️ Chunk into exports/")
+            chunk_status = gr.Markdown()
+            
+            # MinHash/LSH near-duplicate clusters across files/
+            gr.Markdown("### 🧬 Find Near-Duplicates")
+            with gr.Row():
+                dedup_pattern = gr.Textbox(label="Files (glob):", value="*", scale=2)
+                dedup_unit = gr.Radio(DEDUP_UNITS, label="Compare:", value="Files")
+                dedup_threshold = gr.Slider(0.5, 1.0, value=params["dedup_threshold"], step=0.05, label="Minimum similarity")
+            dedup_btn = gr.Button("🧬 Find Near-Duplicates")
+            dedup_status = gr.Markdown()
         
         # Templates Tab
-        with gr.Tab("Templates"):
+        with gr.Tab("Templates") as templates_tab:
             with gr.Row():
                 with gr.Column():
                     template_input = gr.Textbox(
@@ -431,22 +4064,17 @@ def ui():
                     )
                     
                     template_type = gr.Dropdown(
-                        choices=[
-                            "Translation",
-                            "Summary",
-                            "Rewrite",
-                            "Explain",
-                            "Questions",
-                            "Keywords",
-                            "Sentiment",
-                            "Fact Check",
-                            "SD Prompt",
-                            "Custom"
-                        ],
+                        choices=get_template_names(),
                         label="Template Type",
                         value="Summary"
                     )
                     
+                    budget_mode = gr.Radio(
+                        choices=BUDGET_MODES,
+                        value="Off",
+                        label="Fit to context"
+                    )
+                    
                     format_btn = gr.Button("📝 Format for Prompt", variant="primary")
                 
                 with gr.Column():
@@ -454,9 +4082,30 @@ def ui():
                         label="Formatted Prompt",
                         lines=10
                     )
+                    template_status = gr.Markdown()
                     
-                    send_chat_btn = gr.Button("📤 Send to Chat", variant="primary")
+                    generation_target = gr.Textbox(
+                        label="Append replies to file (optional)",
+                        placeholder="e.g. replies.txt"
+                    )
+                    with gr.Row():
+                        send_chat_btn = gr.Button("📤 Send to Chat", variant="primary")
+                        stop_generation_btn = gr.Button("⏹️ Stop")
+                    generation_output = gr.Textbox(
+                        label="Model Reply",
+                        lines=10
+                    )
                     chat_status = gr.Markdown()
+            
+            # One template over many files or chunks
+            gr.Markdown("### 🗂️ Batch Generation")
+            with gr.Row():
+                generation_source = gr.Textbox(
+                    label="Files (glob), or chunk files in exports/ (*.jsonl)",
+                    value="*.txt",
+                    scale=2
+                )
+                batch_generate_btn = gr.Button("🚀 Run Template over All", variant="primary")
         
         # History Tab
         with gr.Tab("History"):
@@ -468,87 +4117,290 @@ def ui():
                     choices=[],
                     label="Select Version"
                 )
+                history_compare_select = gr.Dropdown(
+                    choices=[],
+                    label="Compare With"
+                )
                 restore_btn = gr.Button("♻️ Restore Version")
             
             diff_display = gr.Markdown()
+            
+            # Move the workspace between the plain-file layout and the SQLite store
+            with gr.Accordion("🗄️ Storage", open=False):
+                gr.Markdown(f"Backend: **{params['storage_backend']}** (set `storage_backend` to `\"sqlite\"` to use `{params['database']}`)")
+                with gr.Row():
+                    import_db_btn = gr.Button("⬆️ Import files into SQLite")
+                    export_db_btn = gr.Button("⬇️ Export SQLite to files")
+                storage_status = gr.Markdown()
+            
+            # Prune old backups and trash
+            with gr.Accordion("🧹 Retention", open=False):
+                retention_status = gr.Markdown(format_retention_report(retention_state["last_report"]))
+                with gr.Row():
+                    retention_dry_run_btn = gr.Button("🔍 Dry Run")
+                    retention_run_btn = gr.Button("🧹 Prune Now")
+        
+        # Stats Tab
+        with gr.Tab("Stats") as stats_tab:
+            stats_display = gr.Markdown(format_stats())
+            with gr.Row():
+                refresh_stats_btn = gr.Button("🔄 Refresh")
+                dump_stats_btn = gr.Button("💾 Dump JSON")
+                reset_stats_btn = gr.Button("🗑️ Reset")
+            stats_status = gr.Markdown()
+            stats_json = gr.Code(language="json", label="stats.json")
     
     # Event handlers
     file_dropdown.change(
-        fn=load_file,
-        inputs=[file_dropdown],
-        outputs=[text_editor, save_status]
+        fn=instrumented(with_editor_tag(load_file), "file_dropdown.change"),
+        inputs=[file_dropdown, session_state],
+        outputs=[text_editor, save_status, session_state, editor_tag_box]
     )
     
     save_btn.click(
-        fn=lambda content: save_text(content, current_file if current_file else "untitled.txt"),
-        inputs=[text_editor],
-        outputs=[save_status, text_editor]
+        fn=instrumented(with_file_pickers(with_editor_tag(lambda content, session: save_and_refresh(content, session["current_file"] or "untitled.txt", session)), 2), "save_btn.click"),
+        inputs=[text_editor, session_state],
+        outputs=[save_status, text_editor, file_dropdown, session_state, editor_tag_box, bulk_export_files, sort_source, chunk_source]
+    )
+    
+    prev_page_btn.click(
+        fn=instrumented(with_editor_tag(lambda session: page_window(session, -1)), "prev_page_btn.click"),
+        inputs=[session_state],
+        outputs=[text_editor, save_status, session_state, editor_tag_box]
+    )
+    
+    next_page_btn.click(
+        fn=instrumented(with_editor_tag(lambda session: page_window(session, 1)), "next_page_btn.click"),
+        inputs=[session_state],
+        outputs=[text_editor, save_status, session_state, editor_tag_box]
+    )
+    
+    jump_btn.click(
+        fn=instrumented(with_editor_tag(jump_to_line), "jump_btn.click"),
+        inputs=[session_state, jump_line],
+        outputs=[text_editor, save_status, session_state, editor_tag_box]
     )
     
     save_as_btn.click(
-        fn=lambda content, filename: save_text(content, filename if filename else "untitled.txt"),
-        inputs=[text_editor, save_as_input],
-        outputs=[save_status, text_editor]
+        fn=instrumented(with_file_pickers(with_editor_tag(lambda content, filename, session: save_and_refresh(content, filename or "untitled.txt", session)), 2), "save_as_btn.click"),
+        inputs=[text_editor, save_as_input, session_state],
+        outputs=[save_status, text_editor, file_dropdown, session_state, editor_tag_box, bulk_export_files, sort_source, chunk_source]
     )
     
     create_btn.click(
-        fn=create_new_file,
+        fn=instrumented(with_file_pickers(create_new_file, 1), "create_btn.click"),
         inputs=[new_file_input],
-        outputs=[file_status, file_dropdown]
+        outputs=[file_status, file_dropdown, bulk_export_files, sort_source, chunk_source]
     )
     
     delete_btn.click(
-        fn=lambda filename: delete_file(filename),
+        fn=instrumented(with_file_pickers(delete_file, 1), "delete_btn.click"),
         inputs=[file_dropdown],
-        outputs=[file_status, file_dropdown]
+        outputs=[file_status, file_dropdown, bulk_export_files, sort_source, chunk_source]
     )
     
-    search_btn.click(
-        fn=search_text,
-        inputs=[text_editor, search_input, case_sensitive],
-        outputs=[text_editor]
+    search_event = search_btn.click(
+        fn=instrumented(run_search, "search_btn.click"),
+        inputs=[text_editor, search_input, case_sensitive, search_scope, search_mode, session_state],
+        outputs=[search_results, search_cursor_html, session_state]
+    )
+    
+    prev_match_btn.click(
+        fn=instrumented(with_editor_tag(lambda content, session: navigate_search(content, session, -1)), "prev_match_btn.click"),
+        inputs=[text_editor, session_state],
+        outputs=[text_editor, save_status, search_position, search_cursor_html, session_state, editor_tag_box],
+        cancels=[search_event]
+    )
+    
+    next_match_btn.click(
+        fn=instrumented(with_editor_tag(lambda content, session: navigate_search(content, session, 1)), "next_match_btn.click"),
+        inputs=[text_editor, session_state],
+        outputs=[text_editor, save_status, search_position, search_cursor_html, session_state, editor_tag_box],
+        cancels=[search_event]
     )
     
     add_bookmark_btn.click(
-        fn=lambda content, line, name: add_bookmark(content, int(line), name),
-        inputs=[text_editor, bookmark_line, bookmark_name],
+        fn=instrumented(lambda content, line, name, session: add_bookmark(content, int(line), name, session["current_file"]), "add_bookmark_btn.click"),
+        inputs=[text_editor, bookmark_line, bookmark_name, session_state],
         outputs=[bookmark_status]
     )
     
     process_btn.click(
-        fn=process_text,
+        fn=instrumented(process_text, "process_btn.click"),
         inputs=[process_input, operation_dropdown],
         outputs=[process_output]
     )
     
     export_btn.click(
-        fn=lambda content, format: export_text(content, format, current_file),
-        inputs=[process_output, export_format],
+        fn=instrumented(lambda content, format, compression, session: export_text(content, format, session["current_file"], compression), "export_btn.click"),
+        inputs=[process_output, export_format, export_compression, session_state],
         outputs=[export_status]
     )
     
+    bulk_export_btn.click(
+        fn=instrumented(bulk_export, "bulk_export_btn.click"),
+        inputs=[bulk_export_files, bulk_export_format],
+        outputs=[export_status]
+    )
+    
+    chain_btn.click(
+        fn=instrumented(lambda content, operations: apply_operations(content, operations or []), "chain_btn.click"),
+        inputs=[process_input, chain_operations],
+        outputs=[process_output]
+    )
+    
+    batch_btn.click(
+        fn=instrumented(batch_process, "batch_btn.click"),
+        inputs=[batch_pattern, chain_operations, batch_destination],
+        outputs=[batch_status]
+    )
+    
+    sort_btn.click(
+        fn=instrumented(sort_file, "sort_btn.click"),
+        inputs=[sort_source, sort_unique, sort_numeric, sort_key_field],
+        outputs=[sort_status]
+    )
+    
+    chunk_btn.click(
+        fn=instrumented(chunk_file, "chunk_btn.click"),
+        inputs=[chunk_source, chunk_max_tokens, chunk_overlap],
+        outputs=[chunk_status]
+    )
+    
+    dedup_btn.click(
+        fn=instrumented(find_near_duplicates, "dedup_btn.click"),
+        inputs=[dedup_pattern, dedup_unit, dedup_threshold],
+        outputs=[dedup_status]
+    )
+    
     format_btn.click(
-        fn=format_for_prompt,
-        inputs=[template_input, template_type],
-        outputs=[template_output]
+        fn=instrumented(render_template, "format_btn.click"),
+        inputs=[template_input, template_type, budget_mode],
+        outputs=[template_output, template_status]
+    )
+    
+    send_event = send_chat_btn.click(
+        fn=instrumented(send_to_chat, "send_chat_btn.click"),
+        inputs=[template_output, generation_target],
+        outputs=[generation_output, chat_status]
+    )
+    
+    batch_generate_event = batch_generate_btn.click(
+        fn=instrumented(batch_generate, "batch_generate_btn.click"),
+        inputs=[template_type, budget_mode, generation_source, generation_target],
+        outputs=[generation_output, chat_status]
+    )
+    
+    stop_generation_btn.click(fn=None, cancels=[send_event, batch_generate_event])
+    
+    import_db_btn.click(
+        fn=instrumented(import_workspace_to_sqlite, "import_db_btn.click"),
+        outputs=[storage_status]
+    )
+    
+    export_db_btn.click(
+        fn=instrumented(export_sqlite_to_files, "export_db_btn.click"),
+        outputs=[storage_status]
+    )
+    
+    retention_dry_run_btn.click(
+        fn=instrumented(lambda: format_retention_report(run_retention(dry_run=True)), "retention_dry_run_btn.click"),
+        outputs=[retention_status]
+    )
+    
+    retention_run_btn.click(
+        fn=instrumented(lambda: format_retention_report(run_retention(dry_run=False)), "retention_run_btn.click"),
+        outputs=[retention_status]
+    )
+    
+    # Stats handlers are left uninstrumented so viewing the numbers does not change them
+    for event in (stats_tab.select, refresh_stats_btn.click):
+        event(fn=format_stats, outputs=[stats_display])
+    
+    dump_stats_btn.click(
+        fn=dump_stats,
+        outputs=[stats_json, stats_status]
+    )
+    
+    reset_stats_btn.click(
+        fn=reset_stats,
+        outputs=[stats_display]
+    )
+    
+    refresh_history_btn.click(
+        fn=instrumented(lambda session: list_history(session["current_file"]), "refresh_history_btn.click"),
+        inputs=[session_state],
+        outputs=[history_display, history_file_select, history_compare_select]
+    )
+    
+    for version_select in (history_file_select, history_compare_select):
+        version_select.change(
+            fn=instrumented(lambda old, new, session: compare_history_versions(session["current_file"], old, new), "version_select.change"),
+            inputs=[history_file_select, history_compare_select, session_state],
+            outputs=[diff_display]
+        )
+    
+    restore_btn.click(
+        fn=instrumented(lambda choice, session: restore_version(session["current_file"], choice), "restore_btn.click"),
+        inputs=[history_file_select, session_state],
+        outputs=[text_editor, history_display]
+    )
+    
+    # Sync the editor after a pause in typing, and the other tabs only when opened
+    sync_btn.click(
+        fn=instrumented(sync_and_report, "sync_btn.click"),
+        inputs=[text_editor, session_state, editor_tag_box],
+        outputs=[save_status, session_state]
+    )
+    
+    processing_tab.select(
+        fn=instrumented(lambda content, session, tag: refresh_tab(content, session, "processing", tag), "processing_tab.select"),
+        inputs=[text_editor, session_state, editor_tag_box],
+        outputs=[process_input, session_state]
     )
     
-    send_chat_btn.click(
-        fn=send_to_chat,
-        inputs=[template_output],
-        outputs=[chat_status]
+    templates_tab.select(
+        fn=instrumented(lambda content, session, tag: refresh_tab(content, session, "templates", tag) + (gr.update(choices=get_template_names()),), "templates_tab.select"),
+        inputs=[text_editor, session_state, editor_tag_box],
+        outputs=[template_input, session_state, template_type]
     )
     
-    # Update process input when main editor changes
-    text_editor.change(
-        fn=lambda x: (x, x),
-        inputs=[text_editor],
-        outputs=[process_input, template_input]
+    auto_save.change(
+        fn=instrumented(set_auto_save, "auto_save.change"),
+        inputs=[auto_save, session_state],
+        outputs=[session_state]
     )
+    
+    # Push outside changes to open editors where the Gradio version supports timers;
+    # the timer only ticks while auto-refresh is on
+    if hasattr(gr, "Timer"):
+        refresh_timer = gr.Timer(params["refresh_interval"], active=params["auto_refresh"])
+        refresh_timer.tick(
+            fn=instrumented(with_file_pickers(with_editor_tag(poll_changes), 2), "refresh_timer.tick"),
+            inputs=[session_state],
+            outputs=[text_editor, save_status, file_dropdown, session_state, editor_tag_box, bulk_export_files, sort_source, chunk_source]
+        )
+        auto_refresh.change(
+            fn=instrumented(lambda enabled: (set_auto_refresh(enabled), gr.Timer(active=bool(enabled))), "auto_refresh.change"),
+            inputs=[auto_refresh],
+            outputs=[file_status, refresh_timer]
+        )
+    else:
+        auto_refresh.change(
+            fn=instrumented(set_auto_refresh, "auto_refresh.change"),
+            inputs=[auto_refresh],
+            outputs=[file_status]
+        )
+    
+    startup_report["ui"] = time.perf_counter() - started
 
 def custom_css():
     """Custom CSS for better styling."""
     return """
+    .text-manager-hidden {
+        display: none !important;
+    }
+    
     .text-editor textarea {
         font-family: 'Consolas', 'Monaco', 'Courier New', monospace;
         font-size: 14px;
@@ -605,20 +4457,37 @@ def custom_js():
         // Implementation depends on the specific requirements
     }
     
-    // Auto-save functionality
-    let autoSaveTimer;
-    function setupAutoSave() {
-        const textareas = document.querySelectorAll('.text-editor textarea');
-        textareas.forEach(textarea => {
-            textarea.addEventListener('input', () => {
-                clearTimeout(autoSaveTimer);
-                autoSaveTimer = setTimeout(() => {
-                    // Trigger auto-save after 3 seconds of inactivity
-                    console.log('Auto-saving...');
-                }, 3000);
-            });
-        });
-    }
+    // Send the editor to the server once typing pauses, not on every keystroke
+    let syncTimer;
+    document.addEventListener('input', (e) => {
+        if (!e.target.closest || !e.target.closest('.text-editor')) return;
+        clearTimeout(syncTimer);
+        syncTimer = setTimeout(() => {
+            const syncBtn = document.getElementById('text-manager-sync');
+            if (syncBtn) syncBtn.click();
+        }, __SYNC_DELAY__);
+    });
+    
+    // Select the match the server points at (see search_cursor()) without changing the text
+    let lastSearchSeq = null;
+    new MutationObserver(() => {
+        const marker = document.querySelector('#text-manager-search-cursor [data-seq]');
+        if (!marker || marker.dataset.seq === lastSearchSeq) return;
+        lastSearchSeq = marker.dataset.seq;
+        const textarea = document.querySelector('.text-editor textarea');
+        if (!textarea) return;
+        const lines = textarea.value.split('\\n');
+        const line = Math.min(parseInt(marker.dataset.line, 10), lines.length - 1);
+        let start = 0;
+        for (let i = 0; i < line; i++) start += lines[i].length + 1;
+        // Columns and lengths are counted in code points; the textarea uses UTF-16 units
+        start += Array.from(lines[line]).slice(0, parseInt(marker.dataset.column, 10)).join('').length;
+        const end = start + Array.from(textarea.value.slice(start)).slice(0, parseInt(marker.dataset.length, 10)).join('').length;
+        textarea.focus();
+        textarea.setSelectionRange(start, end);
+        const lineHeight = parseFloat(getComputedStyle(textarea).lineHeight) || 20;
+        textarea.scrollTop = Math.max(0, line * lineHeight - textarea.clientHeight / 2);
+    }).observe(document.body, {childList: true, subtree: true});
     
     // Keyboard shortcuts
     document.addEventListener('keydown', (e) => {
@@ -636,10 +4505,13 @@ def custom_js():
             if (searchInput) searchInput.focus();
         }
     });
-    
-    // Initialize when page loads
-    setTimeout(setupAutoSave, 1000);
-    """
+    """.replace("__SYNC_DELAY__", str(int(params["sync_interval"] * 1000)))
+
+atexit.register(lambda: persist_search_index(force=True))
+atexit.register(persist_file_listing)
+atexit.register(lambda: watcher_state["stop"].set())
+atexit.register(lambda: retention_state["stop"].set())
+atexit.register(lambda: flush_autosave(force=True))
 
 # Optional modifier functions (not used in this extension)
 def input_modifier(string, state, is_chat=False):
@@ -0,0 +1,63 @@
+"""Token chunking with a byte-level stand-in tokenizer."""
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark  # noqa: E402
+
+benchmark.install_stubs()
+
+
+def byte_encode(prompt, add_special_tokens=True, add_bos_token=True, truncation_length=None):
+    """One token per UTF-8 byte, like the fallback of byte-level BPE."""
+    return [list(prompt.encode("utf-8"))]
+
+
+def byte_decode(ids, skip_special_tokens=True):
+    return bytes(ids).decode("utf-8", errors="replace")
+
+
+@pytest.fixture
+def m(tmp_path):
+    module = benchmark.load_extension(str(tmp_path))
+    module.params.update(retention_enabled=False)
+    module.setup()
+    module.encode, module.decode = byte_encode, byte_decode
+    module.token_cache.clear()
+    return module
+
+
+def corpus(seed):
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "déjà", "naïve", "日本語", "emoji😀", "x"]
+    paragraphs = []
+    for _ in range(40):
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(2, 30))) + "." for _ in range(rng.randint(1, 6))]
+        paragraphs.append(" ".join(sentences))
+    # One sentence far longer than any chunk
+    paragraphs.append(" ".join(rng.choice(words) for _ in range(400)))
+    return "\n\n".join(paragraphs)
+
+
+@pytest.mark.parametrize("max_tokens", [64, 200, 511])
+def test_chunks_stay_within_limit(m, max_tokens):
+    chunks = list(m.chunk_by_tokens(iter(corpus(max_tokens).split("\n")), max_tokens, overlap=0))
+    for text, tokens in chunks:
+        assert tokens == len(text.encode("utf-8"))
+        assert tokens <= max_tokens
+
+
+def test_long_sentence_windows_keep_spaces_and_characters(m):
+    sentence = " ".join(["naïve", "日本語", "emoji😀"] * 200)
+    chunks = [text for text, _ in m.chunk_by_tokens(iter([sentence]), 100, overlap=0)]
+    assert "�" not in "".join(chunks)
+    # Chunks follow each other through the sentence with only whitespace between them
+    position = 0
+    for text in chunks:
+        found = sentence.find(text, position)
+        assert found >= 0 and not sentence[position:found].strip()
+        position = found + len(text)
+    assert position == len(sentence)
@@ -0,0 +1,78 @@
+"""Streaming generation with a stub generator, outside text-generation-webui."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark  # noqa: E402
+
+benchmark.install_stubs()
+
+
+@pytest.fixture
+def m(tmp_path):
+    module = benchmark.load_extension(str(tmp_path))
+    module.params.update(retention_enabled=False, stream_ui_interval=0)
+    module.setup()
+    return module
+
+
+def words(*parts):
+    """A stub generate_reply that streams parts one at a time."""
+    def generator(question, state, stopping_strings=None, is_chat=False, **kwargs):
+        reply = ""
+        for part in parts:
+            reply += part
+            yield reply
+    return generator
+
+
+def failing(*parts):
+    """A stub generate_reply that streams parts, then raises."""
+    def generator(question, state, stopping_strings=None, is_chat=False, **kwargs):
+        yield from words(*parts)(question, state)
+        raise RuntimeError("model crashed")
+    return generator
+
+
+def read(m, filename):
+    with open(os.path.join(m.extension_dir, "files", filename), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_streams_reply(m):
+    updates = list(m.send_to_chat("prompt", generator=words("One", " two", " three.")))
+    assert [reply for reply, _ in updates[:-1]] == ["One", "One two", "One two three.", "One two three."]
+    reply, status = updates[-1]
+    assert reply == "One two three."
+    assert status.startswith("✅")
+
+
+def test_appends_reply_to_file(m):
+    list(m.send_to_chat("prompt", "replies", generator=words("First.")))
+    reply, status = list(m.send_to_chat("prompt", "replies.txt", generator=words("Second.")))[-1]
+    content = read(m, "replies.txt")
+    assert content.startswith("## Generated ")
+    assert content.index("First.") < content.index("Second.")
+    assert "replies.txt" in m.get_file_list()
+    assert status.endswith("appended to replies.txt")
+
+
+def test_blank_target_does_not_create_file(m):
+    reply, status = list(m.send_to_chat("prompt", "   ", generator=words("Hi.")))[-1]
+    assert status.startswith("✅")
+    assert not os.path.exists(os.path.join(m.extension_dir, "files", ".txt"))
+
+
+def test_failure_shows_text_already_appended(m):
+    m.params["stream_ui_interval"] = 3600
+    reply, status = list(m.send_to_chat("prompt", "partial.txt", generator=failing("Half", " a reply")))[-1]
+    assert status == "❌ Generation failed: model crashed"
+    assert reply == "Half a reply"
+    assert read(m, "partial.txt").endswith("Half a reply")
+
+
+def test_batch_rejects_invalid_target(m):
+    reply, status = list(m.batch_generate("Summary", "Off", "*.txt", " / ", generator=words("x")))[-1]
+    assert status.startswith("❌ Invalid file name")